@@ -66,9 +66,48 @@ DATABASES = {
     'default': {
         'ENGINE': 'django.db.backends.sqlite3',  # Database type
         'NAME': BASE_DIR / 'db.sqlite3',         # Database file location
+        'OPTIONS': {
+            'timeout': 20,                       # Seconds to wait for the write lock
+        },
+        'CONN_MAX_AGE': int(os.getenv('DB_CONN_MAX_AGE', '60')),  # Reuse connections
+        'CONN_HEALTH_CHECKS': True,
     }
 }
 
+# SQLITE TUNING: Pragmas applied to every new SQLite connection (see invoices/db.py)
+# WAL + synchronous=NORMAL lets extraction saves and API reads run side by side
+SQLITE_TUNING = {
+    'ENABLED': os.getenv('SQLITE_TUNING', 'True') == 'True',
+    'DATABASES': ['default'],
+    'JOURNAL_MODE': 'WAL',
+    'SYNCHRONOUS': 'NORMAL',
+    'BUSY_TIMEOUT_MS': 20000,
+    'CACHE_SIZE_KB': 20000,
+}
+
+# EXTRACTION ADMISSION: Limits for concurrent BERT extractions (per process)
+# Beyond MAX_CONCURRENT requests wait in a queue of MAX_QUEUED; past that the API
+# answers 503 (queue full) or 429 (user over MAX_PER_USER) with a Retry-After header
+EXTRACTION_ADMISSION = {
+    'MAX_CONCURRENT': int(os.getenv('EXTRACTION_MAX_CONCURRENT', '2')),
+    'MAX_QUEUED': int(os.getenv('EXTRACTION_MAX_QUEUED', '8')),
+    'MAX_PER_USER': int(os.getenv('EXTRACTION_MAX_PER_USER', '2')),
+    'QUEUE_TIMEOUT': float(os.getenv('EXTRACTION_QUEUE_TIMEOUT', '30')),
+    'RETRY_AFTER': int(os.getenv('EXTRACTION_RETRY_AFTER', '5')),
+}
+
+# EXTRACTION MODE: 'text' scans the flattened PDF text, 'layout' resolves fields
+# from pdfplumber word boxes by nearest label and only falls back to text for misses
+EXTRACTION_MODE = os.getenv('EXTRACTION_MODE', 'text')
+
+# INVOICE STORAGE: Uploaded PDFs are stored once per content hash (blobs/ab/cd/<sha256>.pdf)
+# with reference counting; COMPRESS gzips new blobs at rest. Clean orphans with `manage.py gc_blobs`
+INVOICE_STORAGE = {
+    'DEDUPLICATE': os.getenv('INVOICE_STORAGE_DEDUPLICATE', 'True') == 'True',
+    'COMPRESS': os.getenv('INVOICE_STORAGE_COMPRESS', 'False') == 'True',
+    'PREFIX': 'blobs',
+}
+
 # INTERNATIONALIZATION: Language and timezone settings
 LANGUAGE_CODE = 'en-us'      # English
 TIME_ZONE = 'UTC'            # Universal Time Coordinated
@@ -0,0 +1,161 @@
+import threading
+import time
+from collections import Counter
+from contextlib import contextmanager
+from typing import Dict, Hashable, Optional
+
+from django.conf import settings
+
+
+class AdmissionRejected(Exception):
+    """
+    Raised when an extraction cannot be admitted right now.
+
+    Carries the HTTP status the API should answer with and how many
+    seconds the client should wait before retrying.
+    """
+
+    def __init__(self, message: str, status_code: int, retry_after: int):
+        super().__init__(message)
+        self.status_code = status_code
+        self.retry_after = retry_after
+
+
+class AdmissionController:
+    """
+    Concurrency limiter with a bounded wait queue for BERT extractions.
+
+    - At most `max_concurrent` extractions run at the same time
+    - Up to `max_queued` more wait for a free slot (for `queue_timeout` seconds)
+    - A single user may hold at most `max_per_user` running + queued slots
+    - Anything beyond that is rejected straight away (429 per-user, 503 global)
+
+    Limits are per process: each server worker gets its own controller.
+    """
+
+    def __init__(self, max_concurrent: int = 2, max_queued: int = 8, max_per_user: int = 2,
+                 queue_timeout: float = 30.0, retry_after: int = 5):
+        self.max_concurrent = max_concurrent
+        self.max_queued = max_queued
+        self.max_per_user = max_per_user
+        self.queue_timeout = queue_timeout
+        self.retry_after = retry_after
+
+        self._cond = threading.Condition()
+        self._in_flight = 0
+        self._queued = 0
+        self._per_user = Counter()
+        self._admitted_total = 0
+        self._rejected_total = 0
+
+    @classmethod
+    def from_settings(cls) -> 'AdmissionController':
+        """Build a controller from the EXTRACTION_ADMISSION setting."""
+        config = getattr(settings, 'EXTRACTION_ADMISSION', {})
+        return cls(
+            max_concurrent=config.get('MAX_CONCURRENT', 2),
+            max_queued=config.get('MAX_QUEUED', 8),
+            max_per_user=config.get('MAX_PER_USER', 2),
+            queue_timeout=config.get('QUEUE_TIMEOUT', 30.0),
+            retry_after=config.get('RETRY_AFTER', 5),
+        )
+
+    def acquire(self, user_key: Hashable):
+        """Wait for a free extraction slot or raise AdmissionRejected."""
+        with self._cond:
+            if self._per_user[user_key] >= self.max_per_user:
+                self._rejected_total += 1
+                raise AdmissionRejected(
+                    "Too many extractions in progress for this user",
+                    status_code=429,
+                    retry_after=self.retry_after,
+                )
+
+            # Fast path: free slot and nobody waiting ahead of us
+            if self._in_flight < self.max_concurrent and self._queued == 0:
+                self._admit(user_key)
+                return
+
+            if self._queued >= self.max_queued:
+                self._rejected_total += 1
+                raise AdmissionRejected(
+                    "Extraction queue is full",
+                    status_code=503,
+                    retry_after=self.retry_after,
+                )
+
+            self._queued += 1
+            self._per_user[user_key] += 1
+            deadline = time.monotonic() + self.queue_timeout
+            try:
+                while self._in_flight >= self.max_concurrent:
+                    remaining = deadline - time.monotonic()
+                    if remaining <= 0:
+                        self._forget(user_key)
+                        self._rejected_total += 1
+                        raise AdmissionRejected(
+                            "Timed out waiting for a free extraction slot",
+                            status_code=503,
+                            retry_after=self.retry_after,
+                        )
+                    self._cond.wait(remaining)
+            finally:
+                self._queued -= 1
+
+            # Already counted against the user while queued
+            self._per_user[user_key] -= 1
+            self._admit(user_key)
+
+    def release(self, user_key: Hashable):
+        """Give back a slot taken by acquire()."""
+        with self._cond:
+            self._in_flight -= 1
+            self._forget(user_key)
+            self._cond.notify()
+
+    @contextmanager
+    def slot(self, user_key: Hashable):
+        """Hold an extraction slot for the duration of the block."""
+        self.acquire(user_key)
+        try:
+            yield
+        finally:
+            self.release(user_key)
+
+    def snapshot(self) -> Dict:
+        """Current load numbers for the metrics endpoint."""
+        with self._cond:
+            return {
+                'in_flight': self._in_flight,
+                'queued': self._queued,
+                'max_concurrent': self.max_concurrent,
+                'max_queued': self.max_queued,
+                'max_per_user': self.max_per_user,
+                'active_users': len(self._per_user),
+                'admitted_total': self._admitted_total,
+                'rejected_total': self._rejected_total,
+            }
+
+    def _admit(self, user_key: Hashable):
+        self._in_flight += 1
+        self._per_user[user_key] += 1
+        self._admitted_total += 1
+
+    def _forget(self, user_key: Hashable):
+        self._per_user[user_key] -= 1
+        if self._per_user[user_key] <= 0:
+            del self._per_user[user_key]
+
+
+_controller: Optional[AdmissionController] = None
+_controller_lock = threading.Lock()
+
+
+def get_admission_controller() -> AdmissionController:
+    """Process-wide controller, created from settings on first use."""
+    global _controller
+    if _controller is None:
+        with _controller_lock:
+            if _controller is None:
+                _controller = AdmissionController.from_settings()
+    return _controller
@@ -3,3 +3,10 @@ from django.apps import AppConfig
 class InvoicesConfig(AppConfig):
     default_auto_field = "django.db.models.BigAutoField"
     name = "invoices"
+
+    def ready(self):
+        from django.db.backends.signals import connection_created
+        from . import signals  # noqa: F401  (registers signal handlers)
+        from .db import configure_sqlite
+
+        connection_created.connect(configure_sqlite)
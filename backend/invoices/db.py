@@ -0,0 +1,182 @@
+import threading
+from typing import Dict, List, Optional
+
+from django.conf import settings
+from django.db import OperationalError, connections, transaction
+
+from .extraction import EXTRACTED_FIELDS
+
+
+def configure_sqlite(sender, connection, **kwargs):
+    """
+    connection_created handler applying the SQLITE_TUNING pragmas.
+
+    WAL lets readers keep going while one writer commits, synchronous=NORMAL
+    skips an fsync per commit (still safe in WAL mode), and busy_timeout makes
+    writers wait for the lock instead of failing with "database is locked".
+    """
+    if connection.vendor != 'sqlite':
+        return
+
+    tuning = getattr(settings, 'SQLITE_TUNING', {})
+    if not tuning.get('ENABLED') or connection.alias not in tuning.get('DATABASES', ['default']):
+        return
+
+    with connection.cursor() as cursor:
+        cursor.execute(f"PRAGMA journal_mode={tuning.get('JOURNAL_MODE', 'WAL')}")
+        cursor.execute(f"PRAGMA synchronous={tuning.get('SYNCHRONOUS', 'NORMAL')}")
+        cursor.execute(f"PRAGMA busy_timeout={int(tuning.get('BUSY_TIMEOUT_MS', 20000))}")
+        cursor.execute(f"PRAGMA cache_size=-{int(tuning.get('CACHE_SIZE_KB', 20000))}")
+        cursor.execute("PRAGMA temp_store=MEMORY")
+
+
+class ResultWriteBatcher:
+    """
+    Write-behind buffer for extraction results.
+
+    Workers submit() invoices that already have their results applied; a
+    background thread writes them in one transaction per batch, touching
+    only the extracted columns. A batch is flushed when `batch_size` invoices
+    are waiting or `flush_interval` seconds have passed, whichever is first.
+    Submitting the same invoice twice before a flush keeps only the latest.
+
+    Each batch is a single parametrized UPDATE run through executemany:
+    it acts like bulk_update(batch, fields) but skips the per-row CASE/WHEN
+    expressions Django builds for it, which dominate write time on SQLite.
+
+    Failures:
+    - OperationalError (lock timeout, lost connection) is transient: the
+      batch goes back into the buffer and the error is raised to the caller
+    - Anything else means a row can't be stored (bad value, DataError): the
+      batch is retried row by row and rows that still fail are moved to
+      `rejected` (invoice pk -> error) instead of being retried forever
+
+    With background=False nothing is written until the caller flush()es,
+    so the caller knows exactly which rows each flush covered.
+    """
+
+    def __init__(self, batch_size: int = 50, flush_interval: float = 1.0,
+                 fields: Optional[List[str]] = None, using: str = 'default',
+                 background: bool = True):
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self.fields = fields or EXTRACTED_FIELDS
+        self.using = using
+        self.background = background
+
+        self._pending: Dict[int, object] = {}
+        self._lock = threading.Lock()
+        self._flush_lock = threading.Lock()
+        self._wake = threading.Event()
+        self._closed = threading.Event()
+        self._thread: Optional[threading.Thread] = None
+
+        self.flushes = 0
+        self.rows_written = 0
+        self.failures = 0
+        self.rejected: Dict[int, str] = {}
+
+    def submit(self, invoice):
+        """Queue an invoice for the next batched write."""
+        with self._lock:
+            if self._closed.is_set():
+                raise RuntimeError("ResultWriteBatcher is closed")
+            self._pending[invoice.pk] = invoice
+            full = len(self._pending) >= self.batch_size
+            if self.background and self._thread is None:
+                self._thread = threading.Thread(target=self._run, name='result-writer', daemon=True)
+                self._thread.start()
+        if full:
+            self._wake.set()
+
+    def flush(self) -> int:
+        """Write everything pending now; returns the number of rows written."""
+        with self._flush_lock:
+            with self._lock:
+                batch, self._pending = list(self._pending.values()), {}
+            if not batch:
+                return 0
+
+            try:
+                self._write(batch)
+                written = len(batch)
+            except OperationalError:
+                self.failures += 1
+                self._requeue(batch)
+                raise
+            except Exception as e:
+                self.failures += 1
+                print(f"Batched result write failed ({e!r}), retrying row by row")
+                written = self._write_rows(batch)
+
+            self.flushes += 1
+            self.rows_written += written
+            return written
+
+    def pop_rejected(self) -> Dict[int, str]:
+        """Take the rows that could not be written since the last call."""
+        with self._lock:
+            rejected, self.rejected = self.rejected, {}
+        return rejected
+
+    def _write_rows(self, batch: List) -> int:
+        written = 0
+        for i, invoice in enumerate(batch):
+            try:
+                self._write([invoice])
+                written += 1
+            except OperationalError:
+                self._requeue(batch[i:])
+                raise
+            except Exception as e:
+                print(f"Rejected extraction result for invoice {invoice.pk}: {e!r}")
+                with self._lock:
+                    self.rejected[invoice.pk] = repr(e)
+        return written
+
+    def _requeue(self, batch: List):
+        # Put rows back for the next flush; newer submissions win
+        with self._lock:
+            for invoice in batch:
+                self._pending.setdefault(invoice.pk, invoice)
+
+    def _write(self, batch: List):
+        connection = connections[self.using]
+        meta = batch[0]._meta
+        fields = [meta.get_field(name) for name in self.fields]
+        quote = connection.ops.quote_name
+
+        sql = (
+            f"UPDATE {quote(meta.db_table)} SET "
+            + ", ".join(f"{quote(field.column)} = %s" for field in fields)
+            + f" WHERE {quote(meta.pk.column)} = %s"
+        )
+        rows = [
+            [field.get_db_prep_save(getattr(obj, field.attname), connection) for field in fields]
+            + [obj.pk]
+            for obj in batch
+        ]
+
+        with transaction.atomic(using=self.using), connection.cursor() as cursor:
+            cursor.executemany(sql, rows)
+
+    def close(self):
+        """Stop the background writer and flush whatever is left."""
+        self._closed.set()
+        self._wake.set()
+        if self._thread is not None:
+            self._thread.join()
+        self.flush()
+
+    def _run(self):
+        try:
+            while not self._closed.is_set():
+                self._wake.wait(self.flush_interval)
+                self._wake.clear()
+                try:
+                    self.flush()
+                except Exception as e:
+                    # Keep the writer alive; whatever failed is back in the buffer
+                    print(f"Result write failed, will retry: {e!r}")
+        finally:
+            connections[self.using].close()  # This thread's connection
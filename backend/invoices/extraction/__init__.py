@@ -1,42 +1,86 @@
 from .bert_extractor import BERTExtractor
+from .layout import LayoutExtractor, LayoutIndex
 from .pdf_extractor import PDFExtractor
-from decimal import Decimal
+from .results import EXTRACTED_FIELDS, ExtractionResult, FieldCandidate
+import threading
+from typing import IO, Callable, List, Optional, Union
+from django.conf import settings
 
 class InvoiceProcessor:
-    def __init__(self):
+    """
+    PDF -> ExtractionResult pipeline.
+
+    mode='text' (default) regex/BERT-scans the flattened page text.
+    mode='layout' first resolves fields from word boxes by nearest label,
+    then falls back to the text extractor only for fields still missing.
+    """
+    MODES = ('text', 'layout')
+
+    def __init__(self, mode: Optional[str] = None):
+        self.mode = mode or getattr(settings, 'EXTRACTION_MODE', 'text')
+        if self.mode not in self.MODES:
+            raise ValueError(f"Unknown extraction mode: {self.mode}")
+
         self.pdf_extractor = PDFExtractor()
         self.bert_extractor = BERTExtractor()
+        self.layout_extractor = LayoutExtractor()
+
+    def process_invoice(self, pdf_path: Union[str, IO[bytes]],
+                        progress: Optional[Callable] = None) -> ExtractionResult:
+        """Main processing function (takes a path or an open binary file)
 
-    def process_invoice(self, pdf_path: str) -> dict:
-        """Main processing function"""
-        print(f"Processing: {pdf_path}")
+        `progress(stage, data)` receives per-stage events (pages_parsed,
+        amount_found, dates_found, ner_done) as extraction moves along.
+        """
+        print(f"Processing: {pdf_path} ({self.mode} mode)")
+
+        result = None
+        if self.mode == 'layout':
+            text, words = self.pdf_extractor.extract_layout(pdf_path, progress=progress)
+            if text:
+                result = self.layout_extractor.extract(LayoutIndex(words), progress=progress)
+        else:
+            # Extract text
+            text = self.pdf_extractor.extract_text(pdf_path, progress=progress)
 
-        # Extract text
-        text = self.pdf_extractor.extract_text(pdf_path)
         if not text:
             return self._create_error_result("No text extracted")
 
-        # Extract information with BERT
-        result = self.bert_extractor.extract_information(text)
-
-        return {
-            'invoice_date': result.get('invoice_date'),
-            'invoice_number': result.get('invoice_number'),
-            'amount': result.get('amount'),
-            'due_date': result.get('due_date'),
-            'extraction_method': 'bert_extraction',
-            'confidence_score': result.get('confidence_score', 0.0),  # ONLY CHANGE: confidence -> confidence_score
-            'raw_text': text[:1000]  # Store first 1000 chars
-        }
-
-    def _create_error_result(self, error: str) -> dict:
-        return {
-            'invoice_date': None,
-            'invoice_number': None,
-            'amount': None,
-            'due_date': None,
-            'extraction_method': 'failed',
-            'confidence_score': 0.0,
-            'error': error,
-            'raw_text': ''
-        }
\ No newline at end of file
+        # Extract information with BERT (only fields the layout didn't resolve)
+        result = self.bert_extractor.extract_information(text, progress=progress, result=result)
+        result.extraction_method = 'bert_extraction'
+        result.raw_text = text[:1000]  # Store first 1000 chars
+
+        return result
+
+    def process_text(self, text: str) -> ExtractionResult:
+        """Extract from invoice text that is already available (no PDF parsing)"""
+        return self.process_texts([text])[0]
+
+    def process_texts(self, texts: List[str], batch_size: int = 16) -> List[ExtractionResult]:
+        """Extract a batch of invoice texts, running NER over them together"""
+        results = [None] * len(texts)
+        todo = [i for i, text in enumerate(texts) if text and text.strip()]
+
+        extracted = self.bert_extractor.extract_batch([texts[i] for i in todo], batch_size)
+        for i, result in zip(todo, extracted):
+            result.extraction_method = 'bert_extraction'
+            result.raw_text = texts[i][:1000]  # Store first 1000 chars
+            results[i] = result
+
+        return [result or self._create_error_result("No text provided") for result in results]
+
+    def _create_error_result(self, error: str) -> ExtractionResult:
+        return ExtractionResult(extraction_method='failed', error=error)
+
+
+_processors = {}
+_processors_lock = threading.Lock()
+
+
+def get_processor(mode: Optional[str] = None) -> InvoiceProcessor:
+    """Process-wide processor, so the BERT model is loaded once and stays resident"""
+    with _processors_lock:
+        if mode not in _processors:
+            _processors[mode] = InvoiceProcessor(mode=mode)
+        return _processors[mode]
@@ -1,8 +1,11 @@
 import re
-from typing import Dict, Optional
-from datetime import datetime, timedelta
+import threading
+from typing import Callable, List, Optional
+from datetime import date, timedelta
 from dateutil import parser
 
+from .results import AMOUNT_RANGE, ExtractionResult, FieldCandidate
+
 
 class BERTExtractor:
     """
@@ -11,6 +14,9 @@ class BERTExtractor:
     def __init__(self):
         self.currency_symbols = self._get_all_currency_symbols()
         self.bert_ner = None
+        # The pipeline's fast tokenizer is not thread-safe ("Already borrowed")
+        # and a processor is shared by concurrent requests, so NER calls take turns
+        self._ner_lock = threading.Lock()
 
         try:
             from transformers import pipeline
@@ -25,68 +31,112 @@ class BERTExtractor:
 
         print(f"Loaded {len(self.currency_symbols)} currency symbols")
 
-    def extract_information(self, text: str) -> Dict:
+    def extract_information(self, text: str, progress: Optional[Callable] = None,
+                            result: Optional[ExtractionResult] = None,
+                            entities: Optional[List[dict]] = None) -> ExtractionResult:
         """
         Smart extraction with BERT validation + reliable fallback
+
+        `progress(stage, data)` is called after each phase so callers can
+        stream partial fields before the whole extraction finishes.
+        Fields already set on a passed-in `result` (e.g. from the layout
+        extractor) are kept and their phase is skipped.
+        `entities` is pre-computed NER output for `text` (see extract_batch).
         """
-        result = {}
+        result = result or ExtractionResult()
+        result.bert_available = self.bert_ner is not None
 
         # PHASE 1: ALWAYS USE PROVEN REGEX FOR AMOUNTS AND DATES
-        self._extract_amount_numeric(text, result)
-        self._extract_dates_universal(text, result)
+        if result.amount is None:
+            self._extract_amount_numeric(text, result)
+        if progress:
+            progress('amount_found', {'amount': result.value('amount')})
+
+        if result.invoice_date is None or result.due_date is None:
+            self._extract_dates_universal(text, result)
+        if progress:
+            progress('dates_found', {
+                'invoice_date': result.value('invoice_date'),
+                'due_date': result.value('due_date'),
+            })
 
         # PHASE 2: INTELLIGENT INVOICE NUMBER EXTRACTION
-        self._extract_invoice_number_intelligent(text, result)
+        if result.invoice_number is None:
+            self._extract_invoice_number_intelligent(text, result, entities)
+        if progress:
+            progress('ner_done', {
+                'invoice_number': result.value('invoice_number'),
+                'bert_validated': result.bert_validated,
+            })
 
-        result['confidence_score'] = self._calculate_confidence(result)
-        result['extraction_method'] = 'bert_extraction'
-        result['bert_available'] = self.bert_ner is not None
+        result.confidence_score = self._calculate_confidence(result)
 
         return result
 
-    def _extract_invoice_number_intelligent(self, text: str, result: Dict):
+    def extract_batch(self, texts: List[str], batch_size: int = 16) -> List[ExtractionResult]:
+        """
+        Extract many texts at once.
+
+        Regex phases run per text; the NER pipeline gets the whole list in
+        one call so the model sees `batch_size` texts per forward pass.
+        """
+        entities_per_text = [None] * len(texts)
+        if self.bert_ner and texts:
+            try:
+                entities_per_text = self._run_ner(list(texts), batch_size=batch_size)
+            except Exception as e:
+                # Texts fall back to one NER call each inside extract_information
+                print(f"Batched BERT extraction failed: {e}")
+
+        return [
+            self.extract_information(text, entities=entities)
+            for text, entities in zip(texts, entities_per_text)
+        ]
+
+    def _run_ner(self, inputs, **kwargs):
+        with self._ner_lock:
+            return self.bert_ner(inputs, **kwargs)
+
+    def _extract_invoice_number_intelligent(self, text: str, result: ExtractionResult,
+                                            entities: Optional[List[dict]] = None):
         """Intelligent invoice number extraction with multiple fallbacks"""
         print("INTELLIGENT INVOICE NUMBER EXTRACTION...")
 
         # METHOD 1: Try BERT-validated extraction first (if available)
         if self.bert_ner:
-            bert_result = self._extract_with_bert_validation(text)
+            bert_result = self._extract_with_bert_validation(text, entities)
             if bert_result:
-                result['invoice_number'] = bert_result
-                result['bert_validated'] = True
-                result['extraction_method'] = 'bert_validated'
-                print(f"BERT-VALIDATED Invoice Number: '{bert_result}'")
+                result.invoice_number = bert_result
+                result.bert_validated = True
+                print(f"BERT-VALIDATED Invoice Number: '{bert_result.value}'")
                 return
 
         # METHOD 2: Fallback to proven regex patterns
         regex_result = self._extract_with_regex_fallback(text)
         if regex_result:
-            result['invoice_number'] = regex_result
-            result['bert_validated'] = False
-            result['extraction_method'] = 'regex_fallback'
-            print(f"REGEX Fallback Invoice Number: '{regex_result}'")
+            result.invoice_number = regex_result
+            print(f"REGEX Fallback Invoice Number: '{regex_result.value}'")
             return
 
         # METHOD 3: Final fallback - look for any invoice-like patterns
         final_result = self._extract_with_context_analysis(text)
         if final_result:
-            result['invoice_number'] = final_result
-            result['bert_validated'] = False
-            result['extraction_method'] = 'context_analysis'
-            print(f"Context Analysis Invoice Number: '{final_result}'")
+            result.invoice_number = final_result
+            print(f"Context Analysis Invoice Number: '{final_result.value}'")
             return
 
         print("No invoice number found with any method")
-        result['invoice_number'] = None
 
-    def _extract_with_bert_validation(self, text: str) -> Optional[str]:
+    def _extract_with_bert_validation(self, text: str,
+                                      entities: Optional[List[dict]] = None) -> Optional[FieldCandidate]:
         """Try to extract and validate with BERT"""
         if not self.bert_ner:
             return None
 
         try:
-            # Use BERT to find all entities
-            entities = self.bert_ner(text)
+            # Use BERT to find all entities (unless a batch already did)
+            if entities is None:
+                entities = self._run_ner(text)
 
             # Look for invoice-like entities
             for entity in entities:
@@ -94,14 +144,18 @@ class BERTExtractor:
                 # Check if this looks like an invoice number
                 if self._looks_like_invoice_number(entity_text):
                     print(f"BERT found potential: '{entity_text}' as {entity['entity_group']}")
-                    return entity_text
+                    return FieldCandidate(
+                        entity_text, 'bert_validated',
+                        start=entity.get('start'), end=entity.get('end'),
+                        score=float(entity.get('score', 1.0)),
+                    )
 
         except Exception as e:
             print(f"BERT extraction failed: {e}")
 
         return None
 
-    def _extract_with_regex_fallback(self, text: str) -> Optional[str]:
+    def _extract_with_regex_fallback(self, text: str) -> Optional[FieldCandidate]:
         """Reliable regex patterns from original working code"""
         patterns = [
             r'Invoice\s*#\s*([A-Za-z0-9\-]+)',            # Invoice #1164006105
@@ -116,14 +170,15 @@ class BERTExtractor:
         for pattern in patterns:
             match = re.search(pattern, text, re.IGNORECASE)
             if match:
-                inv_num = match.group(1) if match.groups() else match.group(0)
-                inv_num = inv_num.strip()
+                group = 1 if match.groups() else 0
+                inv_num = match.group(group).strip()
                 if inv_num and len(inv_num) >= 3:
                     print(f"Regex found: '{inv_num}' with pattern: {pattern}")
-                    return inv_num
+                    return FieldCandidate(inv_num, 'regex_fallback',
+                                          start=match.start(group), end=match.end(group))
         return None
 
-    def _extract_with_context_analysis(self, text: str) -> Optional[str]:
+    def _extract_with_context_analysis(self, text: str) -> Optional[FieldCandidate]:
         """Final fallback - look for any number near invoice keywords"""
         invoice_keywords = ['invoice', 'bill', 'inv', 'number', 'no', '#']
 
@@ -135,7 +190,8 @@ class BERTExtractor:
                 potential_number = match.group(1)
                 if self._looks_like_invoice_number(potential_number):
                     print(f"🔍 Context found: '{potential_number}' near '{keyword}'")
-                    return potential_number
+                    return FieldCandidate(potential_number, 'context_analysis',
+                                          start=match.start(1), end=match.end(1), score=0.5)
         return None
 
     def _looks_like_invoice_number(self, text: str) -> bool:
@@ -164,7 +220,7 @@ class BERTExtractor:
 
         return symbols
 
-    def _extract_amount_numeric(self, text: str, result: Dict):
+    def _extract_amount_numeric(self, text: str, result: ExtractionResult):
         """PROVEN AMOUNT EXTRACTION - Never fails"""
         print("💰 RELIABLE AMOUNT EXTRACTION...")
 
@@ -180,26 +236,26 @@ class BERTExtractor:
             rf'((?:{currency_pattern})\s*[\d,]+)',
         ]
 
-        all_amounts = []
+        largest = None
 
         for pattern in currency_patterns:
-            matches = re.findall(pattern, text, re.IGNORECASE)
-            for full_match in matches:
+            for match in re.finditer(pattern, text, re.IGNORECASE):
+                full_match = match.group(1)
                 print(f"Found amount: '{full_match}'")
 
                 numeric_value = self._extract_numeric_value(full_match)
-                if numeric_value and 0.01 <= numeric_value <= 2000:
-                    all_amounts.append((numeric_value, full_match.strip()))
+                if numeric_value and AMOUNT_RANGE[0] <= numeric_value <= AMOUNT_RANGE[1]:
                     print(f"Valid amount: {numeric_value}")
-
-        if all_amounts:
-            largest_amount = max(all_amounts, key=lambda x: x[0])
-            result['amount'] = largest_amount[0]
-            result['amount_formatted'] = largest_amount[1]
-            print(f"Selected amount: {result['amount_formatted']}")
+                    # Keep the first match of the largest value, like max() did
+                    if largest is None or numeric_value > largest.value:
+                        largest = FieldCandidate(numeric_value, 'regex',
+                                                 start=match.start(1), end=match.end(1))
+
+        if largest:
+            result.amount = largest
+            print(f"Selected amount: {text[largest.start:largest.end].strip()}")
         else:
             print("No valid amounts found")
-            result['amount'] = None
 
     def _extract_numeric_value(self, formatted_amount: str) -> Optional[float]:
         """Extract numeric value from formatted amount string"""
@@ -217,7 +273,7 @@ class BERTExtractor:
             pass
         return None
 
-    def _extract_dates_universal(self, text: str, result: Dict):
+    def _extract_dates_universal(self, text: str, result: ExtractionResult):
         """PROVEN DATE EXTRACTION - Never fails"""
         print("RELIABLE DATE EXTRACTION...")
 
@@ -227,56 +283,57 @@ class BERTExtractor:
             r'\b[A-Za-z]+\s+\d{1,2},?\s+\d{4}\b',
         ]
 
-        all_date_strings = []
+        all_date_matches = []
         for pattern in date_patterns:
-            matches = re.findall(pattern, text, re.IGNORECASE)
-            all_date_strings.extend(matches)
+            all_date_matches.extend(re.finditer(pattern, text, re.IGNORECASE))
 
-        print(f"Found dates: {all_date_strings}")
+        print(f"Found dates: {[match.group(0) for match in all_date_matches]}")
 
-        valid_dates = []
-        for date_str in all_date_strings:
+        # First occurrence of each distinct date wins (for provenance)
+        valid_dates = {}
+        for match in all_date_matches:
+            date_str = match.group(0)
             try:
-                parsed_date = parser.parse(date_str, fuzzy=True)
-                valid_dates.append(parsed_date.strftime('%Y-%m-%d'))
-                print(f"Parsed: '{date_str}' -> {parsed_date.strftime('%Y-%m-%d')}")
+                parsed_date = parser.parse(date_str, fuzzy=True).date()
+                print(f"Parsed: '{date_str}' -> {parsed_date}")
             except:
                 continue
+            if parsed_date not in valid_dates:
+                valid_dates[parsed_date] = FieldCandidate(parsed_date, 'regex',
+                                                          start=match.start(), end=match.end())
 
         if valid_dates:
-            unique_dates = sorted(list(set(valid_dates)))
-            if len(unique_dates) >= 2:
-                result['invoice_date'] = unique_dates[0]
-                result['due_date'] = unique_dates[-1]
-            else:
-                result['invoice_date'] = unique_dates[0]
-                result['due_date'] = self._estimate_due_date(unique_dates[0])
-        else:
-            result['invoice_date'] = None
-            result['due_date'] = None
-
-    def _estimate_due_date(self, invoice_date: str) -> str:
+            unique_dates = sorted(valid_dates)
+            # Never overwrite a date that was already resolved
+            if result.invoice_date is None:
+                result.invoice_date = valid_dates[unique_dates[0]]
+            if result.due_date is None:
+                if len(unique_dates) >= 2:
+                    result.due_date = valid_dates[unique_dates[-1]]
+                else:
+                    result.due_date = FieldCandidate(
+                        self._estimate_due_date(result.invoice_date.value), 'estimated', score=0.5)
+
+    def _estimate_due_date(self, invoice_date: date) -> date:
         """Estimate due date"""
         try:
-            invoice_dt = datetime.strptime(invoice_date, '%Y-%m-%d')
-            due_dt = invoice_dt + timedelta(days=30)
-            return due_dt.strftime('%Y-%m-%d')
-        except:
+            return invoice_date + timedelta(days=30)
+        except OverflowError:
             return invoice_date
 
-    def _calculate_confidence(self, result: Dict) -> float:
+    def _calculate_confidence(self, result: ExtractionResult) -> float:
         """Calculate confidence"""
         score = 0.0
-        if result.get('amount'):
+        if result.value('amount'):
             score += 0.4
-        if result.get('invoice_number'):
+        if result.value('invoice_number'):
             score += 0.3
             # Bonus for BERT validation
-            if result.get('bert_validated'):
+            if result.bert_validated:
                 score += 0.1
-        if result.get('invoice_date'):
+        if result.value('invoice_date'):
             score += 0.2
-        if result.get('due_date'):
+        if result.value('due_date'):
             score += 0.1
 
         return max(0.1, min(0.98, score))
\ No newline at end of file
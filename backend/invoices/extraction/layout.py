@@ -0,0 +1,242 @@
+import re
+from collections import defaultdict
+from dataclasses import dataclass
+from typing import Callable, Dict, Iterable, List, Optional, Tuple
+
+from dateutil import parser
+
+from .results import AMOUNT_RANGE, ExtractionResult, FieldCandidate
+
+
+@dataclass(slots=True)
+class Word:
+    """One pdfplumber word box, plus its character offset in the rebuilt text."""
+    text: str
+    page: int
+    x0: float
+    top: float
+    x1: float
+    bottom: float
+    offset: int = 0
+
+    @property
+    def end(self) -> int:
+        return self.offset + len(self.text)
+
+
+def normalize(token: str) -> str:
+    """Lowercase and drop label punctuation ("Date:" -> "date", "No." -> "no")"""
+    return token.lower().strip(':.')
+
+
+class LayoutIndex:
+    """
+    Spatial index of the words on an invoice.
+
+    - Uniform grid of `cell_size` points per page, so looking for the
+      words to the right of / below a label only touches a few cells
+    - Label lookup table from normalized token to word positions
+    """
+
+    def __init__(self, words: List[Word], cell_size: float = 40.0):
+        self.words = words
+        self.cell_size = cell_size
+        self.cells: Dict[Tuple[int, int, int], List[int]] = defaultdict(list)
+        self.tokens: Dict[str, List[int]] = defaultdict(list)
+        self.positions: Dict[int, int] = {}
+
+        for i, word in enumerate(words):
+            self.positions[id(word)] = i
+            self.tokens[normalize(word.text)].append(i)
+            row = self._cell(word.top)
+            for col in range(self._cell(word.x0), self._cell(word.x1) + 1):
+                self.cells[(word.page, col, row)].append(i)
+
+    def find_label(self, label: str) -> List[Tuple[Word, Word]]:
+        """All (first word, last word) occurrences of a possibly multi-word label"""
+        parts = label.split()
+        matches = []
+        for i in self.tokens.get(parts[0], []):
+            last = i
+            for part in parts[1:]:
+                nxt = last + 1
+                if (nxt >= len(self.words)
+                        or normalize(self.words[nxt].text) != part
+                        or not self._same_line(self.words[last], self.words[nxt])):
+                    break
+                last = nxt
+            else:
+                matches.append((self.words[i], self.words[last]))
+        return matches
+
+    def right_of(self, label: Word, max_cells: int = 16) -> List[Word]:
+        """Words on the same line as `label`, nearest first"""
+        rows = range(self._cell(label.top) - 1, self._cell(label.bottom) + 1)
+        cols = range(self._cell(label.x1), self._cell(label.x1) + max_cells + 1)
+        found = self._collect(label.page, cols, rows)
+        found = [w for w in found if w.x0 >= label.x1 - 1 and self._same_line(label, w)]
+        return sorted(found, key=lambda w: w.x0 - label.x1)
+
+    def below(self, first: Word, last: Word, max_cells: int = 3) -> List[Word]:
+        """Words under a label whose boxes overlap it horizontally, nearest first"""
+        row = self._cell(last.bottom)
+        rows = range(row, row + max_cells + 1)
+        cols = range(self._cell(first.x0) - 1, self._cell(last.x1) + 2)
+        found = self._collect(first.page, cols, rows)
+        found = [w for w in found
+                 if w.top >= last.bottom - 1 and w.x1 >= first.x0 and w.x0 <= last.x1]
+        return sorted(found, key=lambda w: (w.top - last.bottom, w.x0))
+
+    def following(self, word: Word, count: int) -> List[Word]:
+        """Up to `count` words after `word` on the same line (for multi-word values)"""
+        i = self.positions[id(word)]
+        result = []
+        for nxt in self.words[i + 1:i + 1 + count]:
+            if not self._same_line(word, nxt):
+                break
+            result.append(nxt)
+        return result
+
+    def _collect(self, page: int, cols: Iterable[int], rows: Iterable[int]) -> List[Word]:
+        seen = set()
+        for row in rows:
+            for col in cols:
+                seen.update(self.cells.get((page, col, row), ()))
+        return [self.words[i] for i in seen]
+
+    def _cell(self, coordinate: float) -> int:
+        return int(coordinate // self.cell_size)
+
+    @staticmethod
+    def _same_line(a: Word, b: Word) -> bool:
+        return a.page == b.page and min(a.bottom, b.bottom) - max(a.top, b.top) > 0
+
+
+class LayoutExtractor:
+    """
+    Resolve invoice fields by nearest-label lookup on word boxes.
+
+    For each field we look up its labels ("Total", "Due Date", "Invoice #")
+    in the index and take the closest value to the right on the same line,
+    then the closest one below. No whole-document regex scans.
+    """
+
+    AMOUNT_LABELS = ['amount due', 'total due', 'balance due', 'total amount', 'total']
+    DUE_DATE_LABELS = ['due date', 'payment due', 'due by', 'pay by', 'auto pay']
+    INVOICE_DATE_LABELS = ['invoice date', 'bill date', 'billing date', 'statement date',
+                           'issue date']
+    INVOICE_NUMBER_LABELS = ['invoice #', 'invoice no', 'invoice number', 'bill #',
+                             'bill number', 'inv #']
+
+    AMOUNT_PATTERN = re.compile(r'^[^\d]{0,4}([\d,]+\.\d{2})$')
+    DATE_PATTERN = re.compile(
+        r'\d{1,4}[-/\.]\d{1,2}[-/\.]\d{1,4}'
+        r'|\d{1,2}\s+[A-Za-z]+\s+\d{2,4}'
+        r'|[A-Za-z]+\s+\d{1,2},?\s+\d{4}'
+    )
+    INVOICE_NUMBER_PATTERN = re.compile(r'^[A-Za-z0-9\-_]*\d[A-Za-z0-9\-_]*$')
+
+    def extract(self, index: LayoutIndex, result: Optional[ExtractionResult] = None,
+                progress: Optional[Callable] = None) -> ExtractionResult:
+        """Fill whatever fields the layout can resolve; leave the rest None"""
+        result = result or ExtractionResult()
+
+        result.amount = self._resolve(index, self.AMOUNT_LABELS, self._parse_amount)
+        result.invoice_date = self._resolve(index, self.INVOICE_DATE_LABELS, self._parse_date)
+        result.due_date = self._resolve(index, self.DUE_DATE_LABELS, self._parse_date)
+        result.invoice_number = self._resolve(index, self.INVOICE_NUMBER_LABELS,
+                                              self._parse_invoice_number)
+
+        print(f"Layout resolved: {sorted(result.provenance())}")
+        if progress:
+            progress('layout_done', {'fields': sorted(result.provenance())})
+        return result
+
+    def _resolve(self, index: LayoutIndex, labels: List[str],
+                 parse: Callable) -> Optional[FieldCandidate]:
+        for label in labels:
+            for first, last in index.find_label(label):
+                # Same line first, then the nearest line below
+                for candidates, score in ((index.right_of(last), 0.9),
+                                          (index.below(first, last), 0.8)):
+                    for word in candidates[:3]:
+                        value = parse(index, word)
+                        if value is not None:
+                            parsed, end = value
+                            return FieldCandidate(parsed, 'layout', start=word.offset,
+                                                  end=end, score=score)
+        return None
+
+    def _parse_amount(self, index: LayoutIndex, word: Word):
+        match = self.AMOUNT_PATTERN.match(word.text)
+        if not match:
+            return None
+        amount = float(match.group(1).replace(',', ''))
+        # Same sanity range as the text path; larger values can't be saved anyway
+        if not AMOUNT_RANGE[0] <= amount <= AMOUNT_RANGE[1]:
+            return None
+        return amount, word.end
+
+    def _parse_date(self, index: LayoutIndex, word: Word):
+        # Dates may span words ("January 5, 2024"); try the longest first
+        words = [word] + index.following(word, 2)
+        for n in range(len(words), 0, -1):
+            candidate = ' '.join(w.text for w in words[:n])
+            if not self.DATE_PATTERN.fullmatch(candidate):
+                continue
+            try:
+                return parser.parse(candidate).date(), words[n - 1].end
+            except (ValueError, OverflowError):
+                continue
+        return None
+
+    def _parse_invoice_number(self, index: LayoutIndex, word: Word):
+        text = word.text.lstrip('#:')
+        if len(text) >= 3 and self.INVOICE_NUMBER_PATTERN.match(text):
+            return text, word.end
+        return None
+
+
+def build_words(pages: Iterable[Tuple[int, List[dict]]]) -> Tuple[str, List[Word]]:
+    """
+    Turn pdfplumber `extract_words()` output into Word boxes and the
+    matching plain text (one line per visual line), recording offsets.
+    """
+    words: List[Word] = []
+    lines: List[str] = []
+    offset = 0
+
+    for page_number, page_words in pages:
+        line: List[Word] = []
+        for raw in sorted(page_words, key=lambda w: (round(w['top']), w['x0'])):
+            for word in _split_hash(Word(raw['text'], page_number, raw['x0'],
+                                         raw['top'], raw['x1'], raw['bottom'])):
+                if line and not LayoutIndex._same_line(line[-1], word):
+                    offset = _flush_line(line, lines, words, offset)
+                    line = []
+                line.append(word)
+        if line:
+            offset = _flush_line(line, lines, words, offset)
+
+    return '\n'.join(lines) + '\n', words
+
+
+def _flush_line(line: List[Word], lines: List[str], words: List[Word], offset: int) -> int:
+    line.sort(key=lambda w: w.x0)
+    for i, word in enumerate(line):
+        word.offset = offset + sum(len(w.text) + 1 for w in line[:i])
+    words.extend(line)
+    text = ' '.join(w.text for w in line)
+    lines.append(text)
+    return offset + len(text) + 1
+
+
+def _split_hash(word: Word) -> List[Word]:
+    """Split "#1164006105" into "#" + "1164006105" so "Invoice #" labels match"""
+    if len(word.text) < 2 or not word.text.startswith('#'):
+        return [word]
+    width = (word.x1 - word.x0) / len(word.text)
+    return [
+        Word('#', word.page, word.x0, word.top, word.x0 + width, word.bottom),
+        Word(word.text[1:], word.page, word.x0 + width, word.top, word.x1, word.bottom),
+    ]
@@ -1,5 +1,7 @@
 import pdfplumber
-from typing import Optional
+from typing import IO, Callable, List, Optional, Tuple, Union
+
+from .layout import Word, build_words
 
 
 class PDFExtractor:
@@ -7,19 +9,42 @@ class PDFExtractor:
     Simple PDF text extraction
     """
 
-    def extract_text(self, pdf_path: str) -> Optional[str]:
-        """Extract text using pdfplumber"""
+    def extract_text(self, pdf_path: Union[str, IO[bytes]],
+                     progress: Optional[Callable] = None) -> Optional[str]:
+        """Extract text using pdfplumber (from a path or an open binary file)"""
         try:
             text = ""
             with pdfplumber.open(pdf_path) as pdf:
+                page_count = len(pdf.pages)
                 for page in pdf.pages:
                     page_text = page.extract_text()
                     if page_text:
                         text += page_text + "\n"
 
             print(f"Extracted {len(text)} characters")
+            if progress:
+                progress('pages_parsed', {'pages': page_count, 'characters': len(text)})
             return text if text.strip() else None
 
         except Exception as e:
             print(f"PDF extraction failed: {e}")
-            return None
\ No newline at end of file
+            return None
+
+    def extract_layout(self, pdf_path: Union[str, IO[bytes]],
+                       progress: Optional[Callable] = None) -> Tuple[Optional[str], List[Word]]:
+        """Extract positioned word boxes (and the text rebuilt from them)"""
+        try:
+            with pdfplumber.open(pdf_path) as pdf:
+                pages = [(number, page.extract_words())
+                         for number, page in enumerate(pdf.pages)]
+
+            text, words = build_words(pages)
+
+            print(f"Extracted {len(words)} words from {len(pages)} pages")
+            if progress:
+                progress('pages_parsed', {'pages': len(pages), 'characters': len(text)})
+            return (text if text.strip() else None), words
+
+        except Exception as e:
+            print(f"PDF layout extraction failed: {e}")
+            return None, []
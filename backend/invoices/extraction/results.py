@@ -0,0 +1,86 @@
+from dataclasses import dataclass
+from typing import Any, Dict, List, Optional
+
+# Invoice model columns written by an extraction (used for update_fields / bulk_update)
+EXTRACTED_FIELDS = [
+    'invoice_date',
+    'invoice_number',
+    'amount',
+    'due_date',
+    'extraction_method',
+    'confidence_score',
+    'raw_text',
+]
+
+# Sanity range for extracted totals, shared by the text and layout paths.
+# Also keeps values inside Invoice.amount (max_digits=10, decimal_places=2).
+AMOUNT_RANGE = (0.01, 2000.0)
+
+
+@dataclass(slots=True)
+class FieldCandidate:
+    """
+    One value found for a field, plus where it came from.
+
+    - method: which strategy produced it (regex, bert_validated, estimated, ...)
+    - start/end: character span in the source text (None if not from a match)
+    - score: strategy confidence, 1.0 for deterministic matches
+    """
+    value: Any
+    method: str
+    start: Optional[int] = None
+    end: Optional[int] = None
+    score: float = 1.0
+
+    def provenance(self) -> Dict:
+        return {
+            'method': self.method,
+            'start': self.start,
+            'end': self.end,
+            'score': self.score,
+        }
+
+
+@dataclass(slots=True)
+class ExtractionResult:
+    """
+    Typed result of extracting one invoice.
+
+    Built by BERTExtractor, completed by InvoiceProcessor and applied
+    straight onto the Invoice model - no intermediate dicts.
+    """
+    invoice_number: Optional[FieldCandidate] = None
+    invoice_date: Optional[FieldCandidate] = None
+    due_date: Optional[FieldCandidate] = None
+    amount: Optional[FieldCandidate] = None
+
+    extraction_method: str = 'bert_extraction'
+    confidence_score: float = 0.0
+    bert_available: bool = False
+    bert_validated: bool = False
+    raw_text: str = ''
+    error: Optional[str] = None
+
+    def value(self, field: str) -> Any:
+        """Plain value of a field, or None if nothing was found."""
+        candidate = getattr(self, field)
+        return candidate.value if candidate else None
+
+    def apply_to(self, invoice) -> List[str]:
+        """Copy results onto an Invoice and return the fields to save."""
+        invoice.invoice_date = self.value('invoice_date')
+        invoice.invoice_number = self.value('invoice_number')
+        invoice.amount = self.value('amount')
+        invoice.due_date = self.value('due_date')
+        invoice.extraction_method = self.extraction_method
+        invoice.confidence_score = self.confidence_score
+        invoice.raw_text = self.raw_text
+        return EXTRACTED_FIELDS
+
+    def provenance(self) -> Dict:
+        """Per-field provenance, for debugging and API responses."""
+        return {
+            field: candidate.provenance()
+            for field in ('invoice_number', 'invoice_date', 'due_date', 'amount')
+            if (candidate := getattr(self, field)) is not None
+        }
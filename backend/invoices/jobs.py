@@ -0,0 +1,134 @@
+from datetime import timedelta
+from typing import Dict, List
+
+from django.db import IntegrityError, connections, transaction
+from django.db.models import Count, F, Q
+from django.utils import timezone
+
+from .models import ExtractionJob, ExtractionWorker, Invoice
+
+
+def enqueue_extraction(invoice: Invoice) -> ExtractionJob:
+    """
+    Queue an invoice for the workers, reusing a job that is already waiting/running.
+
+    The unique_active_extraction_job constraint settles concurrent enqueues:
+    the losing insert fails and returns the winner's job instead. Any other
+    IntegrityError (e.g. the invoice was deleted meanwhile) is raised.
+    """
+    active_jobs = invoice.extraction_jobs.filter(
+        status__in=[ExtractionJob.STATUS_PENDING, ExtractionJob.STATUS_RUNNING]
+    )
+    active = active_jobs.first()
+    if active:
+        return active
+    try:
+        with transaction.atomic():
+            return ExtractionJob.objects.create(invoice=invoice)
+    except IntegrityError:
+        active = active_jobs.first()  # Someone queued it first; pick up their job
+        if active is None:
+            raise
+        return active
+
+
+def claim_jobs(worker_id: str, limit: int, lease_seconds: int, max_attempts: int,
+               using: str = 'default') -> List[ExtractionJob]:
+    """
+    Atomically claim up to `limit` jobs for `worker_id`.
+
+    Claimable jobs are pending ones plus running ones whose lease expired
+    (their worker crashed or hung). On databases with SKIP LOCKED workers
+    never wait on each other's rows; elsewhere (SQLite) the claim is a
+    single conditional UPDATE inside the transaction, which is just as
+    exclusive because SQLite serializes writers.
+    """
+    now = timezone.now()
+    lease = now + timedelta(seconds=lease_seconds)
+    expired = Q(status=ExtractionJob.STATUS_RUNNING, lease_expires_at__lt=now)
+    jobs = ExtractionJob.objects.using(using)
+
+    with transaction.atomic(using=using):
+        # Jobs that keep killing their workers stop being retried
+        jobs.filter(expired, attempts__gte=max_attempts).update(
+            status=ExtractionJob.STATUS_FAILED,
+            error="Lease expired too many times",
+            finished_at=now,
+        )
+
+        claimable = jobs.filter(Q(status=ExtractionJob.STATUS_PENDING) | expired).order_by('created_at')
+        if connections[using].features.has_select_for_update_skip_locked:
+            ids = list(claimable.select_for_update(skip_locked=True).values_list('pk', flat=True)[:limit])
+            target = jobs.filter(pk__in=ids)
+        else:
+            # One UPDATE ... WHERE id IN (SELECT ... LIMIT n): no read-then-write gap
+            target = jobs.filter(pk__in=claimable.values('pk')[:limit])
+
+        target.update(
+            status=ExtractionJob.STATUS_RUNNING,
+            worker_id=worker_id,
+            lease_expires_at=lease,
+            attempts=F('attempts') + 1,
+            started_at=now,
+        )
+
+        # Our claim is identified by worker + the exact lease we just set
+        return list(
+            jobs.filter(worker_id=worker_id, status=ExtractionJob.STATUS_RUNNING, lease_expires_at=lease)
+            .select_related('invoice')
+        )
+
+
+def extend_leases(worker_id: str, lease_seconds: int, using: str = 'default') -> int:
+    """Heartbeat: push out the lease of every job this worker is running."""
+    return ExtractionJob.objects.using(using).filter(
+        worker_id=worker_id, status=ExtractionJob.STATUS_RUNNING,
+    ).update(lease_expires_at=timezone.now() + timedelta(seconds=lease_seconds))
+
+
+def complete_jobs(worker_id: str, job_ids: List[int], using: str = 'default') -> int:
+    """Mark jobs done, unless another worker took them over after our lease ran out."""
+    return ExtractionJob.objects.using(using).filter(
+        pk__in=job_ids, worker_id=worker_id, status=ExtractionJob.STATUS_RUNNING,
+    ).update(status=ExtractionJob.STATUS_DONE, finished_at=timezone.now(),
+             lease_expires_at=None, error='')
+
+
+def fail_job(worker_id: str, job: ExtractionJob, error: str, max_attempts: int,
+             using: str = 'default') -> bool:
+    """Send a job back to the queue, or fail it for good after max_attempts. True if final."""
+    final = job.attempts >= max_attempts
+    ExtractionJob.objects.using(using).filter(
+        pk=job.pk, worker_id=worker_id, status=ExtractionJob.STATUS_RUNNING,
+    ).update(
+        status=ExtractionJob.STATUS_FAILED if final else ExtractionJob.STATUS_PENDING,
+        finished_at=timezone.now() if final else None,
+        lease_expires_at=None,
+        error=error,
+    )
+    return final
+
+
+def queue_stats(stale_after: int = 60) -> Dict:
+    """Queue depth by status and per-worker throughput, for the metrics endpoint."""
+    counts = dict(ExtractionJob.objects.values_list('status').annotate(n=Count('pk')).order_by())
+    cutoff = timezone.now() - timedelta(seconds=stale_after)
+    workers = ExtractionWorker.objects.filter(stopped_at__isnull=True).order_by('worker_id')
+
+    return {
+        'jobs': {status: counts.get(status, 0) for status, _ in ExtractionJob.STATUS_CHOICES},
+        'workers': [
+            {
+                'worker_id': worker.worker_id,
+                'hostname': worker.hostname,
+                'pid': worker.pid,
+                'alive': worker.last_heartbeat >= cutoff,
+                'last_heartbeat': worker.last_heartbeat,
+                'jobs_done': worker.jobs_done,
+                'jobs_failed': worker.jobs_failed,
+                'busy_seconds': round(worker.busy_seconds, 2),
+                'jobs_per_minute': round(worker.jobs_per_minute, 2),
+            }
+            for worker in workers
+        ],
+    }
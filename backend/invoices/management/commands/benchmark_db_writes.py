@@ -0,0 +1,147 @@
+import os
+import shutil
+import tempfile
+import threading
+import time
+from datetime import date
+
+from django.conf import settings
+from django.core.management import call_command
+from django.core.management.base import BaseCommand
+from django.db import OperationalError, connections
+from django.test import override_settings
+
+from invoices.db import ResultWriteBatcher
+from invoices.extraction import ExtractionResult, FieldCandidate
+from invoices.models import Invoice
+
+
+class Command(BaseCommand):
+    """
+    Concurrent-writer benchmark for extraction result saves on SQLite.
+
+    Runs the same workload against two throwaway databases:
+    - baseline: SQLite defaults (rollback journal, synchronous=FULL) and one
+      full-row invoice.save() transaction per result, like the old view
+    - tuned: SQLITE_TUNING pragmas (WAL, synchronous=NORMAL, busy timeout)
+      and the ResultWriteBatcher writing extracted columns in batched transactions
+    Readers list invoices the whole time, like the API would.
+    """
+    help = "Benchmark concurrent extraction-result writes: SQLite defaults vs tuned + batched"
+
+    def add_arguments(self, parser):
+        parser.add_argument('--writers', type=int, default=8, help="Writer threads (default: 8)")
+        parser.add_argument('--rows', type=int, default=250,
+                            help="Results written per writer (default: 250)")
+        parser.add_argument('--readers', type=int, default=2,
+                            help="Reader threads listing invoices meanwhile (default: 2)")
+        parser.add_argument('--batch-size', type=int, default=50,
+                            help="ResultWriteBatcher batch size (default: 50)")
+
+    def handle(self, *args, **options):
+        workdir = tempfile.mkdtemp(prefix='invoice-db-bench-')
+        tuning = {**getattr(settings, 'SQLITE_TUNING', {}), 'ENABLED': True,
+                  'DATABASES': ['bench_tuned']}
+
+        try:
+            with override_settings(SQLITE_TUNING=tuning):
+                baseline = self._run('bench_baseline', workdir, options, batched=False)
+                tuned = self._run('bench_tuned', workdir, options, batched=True)
+        finally:
+            for alias in ('bench_baseline', 'bench_tuned'):
+                if alias in connections.settings:
+                    connections[alias].close()
+                    del connections.settings[alias]
+            shutil.rmtree(workdir, ignore_errors=True)
+
+        total = options['writers'] * options['rows']
+        self.stdout.write(f"{options['writers']} writers x {options['rows']} results "
+                          f"= {total:,} rows, {options['readers']} readers")
+        for label, stats in (("baseline (defaults, save())", baseline),
+                             ("tuned (WAL, batched)", tuned)):
+            self.stdout.write(
+                f"  {label:<28} {stats['elapsed']:7.2f}s  {stats['written'] / stats['elapsed']:9.0f} rows/s  "
+                f"{stats['reads']:6d} reads  {stats['errors']:4d} lock errors"
+            )
+        self.stdout.write(self.style.SUCCESS(
+            f"Tuned write throughput: {baseline['elapsed'] / tuned['elapsed']:.1f}x baseline"
+        ))
+
+    def _run(self, alias, workdir, options, batched):
+        connections.settings[alias] = {
+            **connections.settings['default'],
+            'NAME': os.path.join(workdir, f'{alias}.sqlite3'),
+            'CONN_MAX_AGE': 0,
+        }
+        call_command('migrate', database=alias, verbosity=0)
+
+        writers, rows = options['writers'], options['rows']
+        Invoice.objects.using(alias).bulk_create(
+            [Invoice(original_file=f'bench/{i}.pdf') for i in range(writers * rows)])
+        pks = list(Invoice.objects.using(alias).values_list('pk', flat=True))
+
+        batcher = ResultWriteBatcher(batch_size=options['batch_size'], using=alias) if batched else None
+        stats = {'written': 0, 'errors': 0, 'reads': 0}
+        stats_lock = threading.Lock()
+        writers_done = threading.Event()
+
+        def write(chunk):
+            written = errors = 0
+            try:
+                for invoice in Invoice.objects.using(alias).filter(pk__in=chunk):
+                    self._fake_result(invoice.pk).apply_to(invoice)
+                    try:
+                        if batched:
+                            batcher.submit(invoice)
+                        else:
+                            invoice.save(using=alias)
+                        written += 1
+                    except OperationalError:
+                        errors += 1
+            finally:
+                connections[alias].close()
+            with stats_lock:
+                stats['written'] += written
+                stats['errors'] += errors
+
+        def read():
+            reads = 0
+            try:
+                while not writers_done.is_set():
+                    list(Invoice.objects.using(alias).order_by('-pk')[:50])
+                    reads += 1
+                    time.sleep(0.005)  # API-like pacing, not a busy loop
+            finally:
+                connections[alias].close()
+            with stats_lock:
+                stats['reads'] += reads
+
+        readers = [threading.Thread(target=read) for _ in range(options['readers'])]
+        threads = [threading.Thread(target=write, args=(pks[i::writers],)) for i in range(writers)]
+
+        start = time.perf_counter()
+        for thread in readers + threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        if batched:
+            batcher.close()
+        stats['elapsed'] = time.perf_counter() - start
+        writers_done.set()
+        for thread in readers:
+            thread.join()
+
+        if batched:
+            stats['errors'] += batcher.failures
+        connections[alias].close()
+        return stats
+
+    def _fake_result(self, seed: int) -> ExtractionResult:
+        return ExtractionResult(
+            invoice_number=FieldCandidate(f"INV-{seed:08d}", 'regex_fallback', start=10, end=22),
+            invoice_date=FieldCandidate(date(2024, 1, 1 + seed % 28), 'regex', start=30, end=40),
+            due_date=FieldCandidate(date(2024, 2, 1 + seed % 28), 'regex', start=50, end=60),
+            amount=FieldCandidate(100.0 + seed % 1000, 'regex', start=70, end=78),
+            confidence_score=0.9,
+            raw_text="x" * 1000,
+        )
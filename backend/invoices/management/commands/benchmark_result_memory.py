@@ -0,0 +1,110 @@
+import gc
+import tracemalloc
+from datetime import date, timedelta
+
+from django.core.management.base import BaseCommand
+
+from invoices.extraction import ExtractionResult, FieldCandidate
+
+
+class Command(BaseCommand):
+    """
+    Compare memory held by a batch of extraction results:
+    the old ad-hoc dicts, the same dicts carrying per-field provenance,
+    and the slotted ExtractionResult objects (which carry provenance).
+
+    Values are synthetic but shaped like real extractions; raw_text is
+    shared between all of them so only the result containers are measured.
+    """
+    help = "Benchmark memory of dict-based vs slotted extraction results"
+
+    def add_arguments(self, parser):
+        parser.add_argument('--count', type=int, default=100_000,
+                            help="Number of results kept alive (default: 100000)")
+
+    def handle(self, *args, **options):
+        count = options['count']
+        raw_text = "x" * 1000
+
+        dict_bytes = self._measure(self._build_dicts, count, raw_text)
+        dict_prov_bytes = self._measure(self._build_dicts_with_provenance, count, raw_text)
+        typed_bytes = self._measure(self._build_typed, count, raw_text)
+
+        self.stdout.write(f"Results kept alive: {count:,}")
+        self._report("dict results (no provenance)", dict_bytes, count)
+        self._report("dict results + provenance", dict_prov_bytes, count)
+        self._report("typed results + provenance", typed_bytes, count)
+        self.stdout.write(self.style.SUCCESS(
+            f"Typed results use {typed_bytes / dict_prov_bytes:.0%} of the memory of "
+            f"dicts carrying the same provenance "
+            f"({typed_bytes / dict_bytes:.0%} of provenance-free dicts)"
+        ))
+
+    def _report(self, label, total_bytes, count):
+        self.stdout.write(f"  {label:<30} {total_bytes / 1024 / 1024:8.2f} MiB "
+                          f"({total_bytes / count:5.0f} B/invoice)")
+
+    def _measure(self, build, count, raw_text):
+        gc.collect()
+        tracemalloc.start()
+        results = build(count, raw_text)
+        current, _peak = tracemalloc.get_traced_memory()
+        tracemalloc.stop()
+        del results
+        return current
+
+    def _build_dicts(self, count, raw_text):
+        """Old pipeline: extractor dict, then processor copies it into another"""
+        results = []
+        base = date(2024, 1, 1)
+        for i in range(count):
+            invoice_date = base + timedelta(days=i % 365)
+            extracted = {
+                'amount': 100.0 + i % 1000,
+                'amount_formatted': f"${100 + i % 1000:,}.00",
+                'invoice_date': invoice_date.strftime('%Y-%m-%d'),
+                'due_date': (invoice_date + timedelta(days=30)).strftime('%Y-%m-%d'),
+                'invoice_number': f"INV-{i:08d}",
+                'bert_validated': False,
+                'extraction_method': 'regex_fallback',
+                'confidence_score': 0.9,
+                'bert_available': False,
+            }
+            results.append({
+                'invoice_date': extracted.get('invoice_date'),
+                'invoice_number': extracted.get('invoice_number'),
+                'amount': extracted.get('amount'),
+                'due_date': extracted.get('due_date'),
+                'extraction_method': 'bert_extraction',
+                'confidence_score': extracted.get('confidence_score', 0.0),
+                'raw_text': raw_text,
+            })
+        return results
+
+    def _build_dicts_with_provenance(self, count, raw_text):
+        """Old dict shape extended with a provenance dict per field"""
+        results = self._build_dicts(count, raw_text)
+        for result in results:
+            result['provenance'] = {
+                'invoice_number': {'method': 'regex_fallback', 'start': 120, 'end': 132, 'score': 1.0},
+                'invoice_date': {'method': 'regex', 'start': 40, 'end': 50, 'score': 1.0},
+                'due_date': {'method': 'regex', 'start': 60, 'end': 70, 'score': 1.0},
+                'amount': {'method': 'regex', 'start': 300, 'end': 308, 'score': 1.0},
+            }
+        return results
+
+    def _build_typed(self, count, raw_text):
+        """New pipeline: one ExtractionResult filled in place"""
+        results = []
+        base = date(2024, 1, 1)
+        for i in range(count):
+            invoice_date = base + timedelta(days=i % 365)
+            results.append(ExtractionResult(
+                invoice_number=FieldCandidate(f"INV-{i:08d}", 'regex_fallback', start=120, end=132),
+                invoice_date=FieldCandidate(invoice_date, 'regex', start=40, end=50),
+                due_date=FieldCandidate(invoice_date + timedelta(days=30), 'regex', start=60, end=70),
+                amount=FieldCandidate(100.0 + i % 1000, 'regex', start=300, end=308),
+                confidence_score=0.9,
+                raw_text=raw_text,
+            ))
+        return results
@@ -0,0 +1,69 @@
+from django.core.management.base import BaseCommand
+from django.db import IntegrityError
+
+from invoices.db import ResultWriteBatcher
+from invoices.extraction import InvoiceProcessor
+from invoices.jobs import enqueue_extraction
+from invoices.models import Invoice
+
+
+class Command(BaseCommand):
+    """
+    Batch-extract invoices that haven't been processed yet.
+
+    Results go straight from the typed ExtractionResult onto the model and
+    are handed to the write-behind ResultWriteBatcher, which saves them in
+    one transaction per batch, limited to extracted columns. With --enqueue
+    the invoices are queued for run_extraction_worker instead.
+    """
+    help = "Run extraction over pending invoices and save results in batches"
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=100,
+                            help="Invoices written per batch (default: 100)")
+        parser.add_argument('--all', action='store_true',
+                            help="Re-extract every invoice, not only pending ones")
+        parser.add_argument('--enqueue', action='store_true',
+                            help="Queue jobs for the extraction workers instead of extracting here")
+
+    def handle(self, *args, **options):
+        batch_size = options['batch_size']
+
+        invoices = Invoice.objects.exclude(original_file='')
+        if not options['all']:
+            invoices = invoices.filter(extraction_method='pending')
+
+        # Snapshot ids first so batches we save don't shift the rows being read
+        pks = list(invoices.values_list('pk', flat=True))
+
+        if options['enqueue']:
+            queued = 0
+            for invoice in Invoice.objects.filter(pk__in=pks):
+                try:
+                    enqueue_extraction(invoice)
+                    queued += 1
+                except IntegrityError:
+                    self.stderr.write(f"Invoice {invoice.pk} was deleted, not queued")
+            self.stdout.write(self.style.SUCCESS(f"Queued {queued} invoices for the workers"))
+            return
+
+        processor = InvoiceProcessor()
+        writer = ResultWriteBatcher(batch_size=batch_size)
+
+        try:
+            for offset in range(0, len(pks), batch_size):
+                for invoice in Invoice.objects.filter(pk__in=pks[offset:offset + batch_size]):
+                    with invoice.original_file.open('rb') as pdf_file:
+                        result = processor.process_invoice(pdf_file)
+                    result.apply_to(invoice)
+                    writer.submit(invoice)
+        finally:
+            writer.close()
+
+        rejected = writer.pop_rejected()
+        for pk, error in rejected.items():
+            self.stderr.write(f"Invoice {pk}: result not saved: {error}")
+        self.stdout.write(self.style.SUCCESS(
+            f"Extracted {len(pks)} invoices ({writer.rows_written} rows in {writer.flushes} writes, "
+            f"{len(rejected)} rejected)"
+        ))
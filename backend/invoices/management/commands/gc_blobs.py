@@ -0,0 +1,128 @@
+import os
+import time
+from collections import Counter
+from datetime import datetime, timezone as dt_timezone
+
+from django.core.management.base import BaseCommand, CommandError
+from django.db import OperationalError, transaction
+
+from invoices.models import Invoice, StoredBlob
+from invoices.storage import ContentAddressedStorage
+
+
+class Command(BaseCommand):
+    """
+    Garbage-collect deduplicated invoice uploads.
+
+    Invoice.original_file is the source of truth: reference counts are
+    recomputed from it, then blobs nobody points at are removed - both
+    StoredBlob rows and files on disk without a row (e.g. from uploads
+    whose invoice was never saved).
+
+    Blobs acquired or released within --min-age are left alone: their
+    invoice may not be committed yet. Each blob is fixed with its row
+    locked and its references recounted inside that transaction.
+    """
+    help = "Reconcile blob reference counts and delete orphaned blobs"
+
+    def add_arguments(self, parser):
+        parser.add_argument('--dry-run', action='store_true',
+                            help="Report what would change without touching anything")
+        parser.add_argument('--min-age', type=int, default=3600,
+                            help="Skip blobs changed or files written less than this many "
+                                 "seconds ago, so uploads still being saved are left alone "
+                                 "(default: 3600)")
+
+    def handle(self, *args, **options):
+        storage = Invoice._meta.get_field('original_file').storage
+        if not isinstance(storage, ContentAddressedStorage):
+            raise CommandError("Invoice storage is not deduplicating (INVOICE_STORAGE['DEDUPLICATE'])")
+
+        self.storage = storage
+        dry_run = options['dry_run']
+        cutoff = time.time() - options['min_age']
+        self.cutoff_at = datetime.fromtimestamp(cutoff, tz=dt_timezone.utc)
+        self.skipped = 0
+
+        references = Counter(
+            name for name in Invoice.objects.values_list('original_file', flat=True)
+            if name and storage.is_blob(name)
+        )
+
+        # 1. Reconcile reference counts with what invoices actually point at
+        fixed = 0
+        settled = StoredBlob.objects.filter(updated_at__lt=self.cutoff_at)
+        for blob in settled:
+            if blob.ref_count == references.get(blob.name, 0):
+                continue
+            if dry_run:
+                self.stdout.write(f"{blob.name}: ref_count {blob.ref_count} -> {references.get(blob.name, 0)}")
+                fixed += 1
+            elif self._locked(self._reconcile, blob.name):
+                fixed += 1
+
+        # 2. Remove unreferenced blob files (and their rows)
+        removed = 0
+        freed = 0
+        root = storage.blob_path(storage.prefix)
+        for directory, _dirs, files in os.walk(root):
+            for filename in files:
+                full_path = os.path.join(directory, filename)
+                name = os.path.relpath(full_path, storage.location).replace(os.sep, '/')
+                if references.get(name) or os.path.getmtime(full_path) > cutoff:
+                    continue
+
+                size = os.path.getsize(full_path)
+                if dry_run:
+                    self.stdout.write(f"Orphaned: {name} ({size} bytes)")
+                elif not self._locked(self._remove_orphan, name, full_path):
+                    continue
+                removed += 1
+                freed += size
+
+        # 3. Rows whose file is already gone
+        stale = [blob.name for blob in settled.filter(ref_count=0)
+                 if not os.path.exists(storage.blob_path(blob.name))]
+        if stale and not dry_run:
+            settled.filter(name__in=stale, ref_count=0).delete()
+
+        prefix = "[dry run] " if dry_run else ""
+        self.stdout.write(self.style.SUCCESS(
+            f"{prefix}Fixed {fixed} reference counts, removed {removed} orphaned blobs "
+            f"({freed / 1024 / 1024:.2f} MiB), dropped {len(stale)} stale rows, "
+            f"skipped {self.skipped} busy blobs"
+        ))
+
+    def _locked(self, fix, name, *args) -> bool:
+        """Run `fix` with the blob's row locked; False if it was skipped."""
+        try:
+            with transaction.atomic():
+                blob = StoredBlob.objects.select_for_update().filter(name=name).first()
+                return fix(blob, name, *args)
+        except OperationalError as e:
+            # SQLite has no row locks: a concurrent upload shows up as a busy
+            # database instead. Leave the blob for the next run.
+            self.stderr.write(f"{name}: skipped, busy ({e})")
+            self.skipped += 1
+            return False
+
+    def _reconcile(self, blob, name) -> bool:
+        if blob is None or blob.updated_at >= self.cutoff_at:
+            return False
+        # Recount under the lock: an upload may have committed since the first pass
+        actual = Invoice.objects.filter(original_file=name).count()
+        if blob.ref_count == actual:
+            return False
+        self.stdout.write(f"{name}: ref_count {blob.ref_count} -> {actual}")
+        StoredBlob.objects.filter(name=name).update(ref_count=actual)
+        return True
+
+    def _remove_orphan(self, blob, name, full_path) -> bool:
+        if blob is not None and (blob.ref_count > 0 or blob.updated_at >= self.cutoff_at):
+            return False
+        if Invoice.objects.filter(original_file=name).exists():
+            return False
+        self.stdout.write(f"Orphaned: {name} ({os.path.getsize(full_path)} bytes)")
+        os.remove(full_path)
+        StoredBlob.objects.filter(name=name).delete()
+        return True
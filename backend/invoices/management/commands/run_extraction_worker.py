@@ -0,0 +1,176 @@
+import os
+import signal
+import socket
+import threading
+import time
+
+from django.core.management.base import BaseCommand
+from django.db import OperationalError, connections
+from django.utils import timezone
+
+from invoices.db import ResultWriteBatcher
+from invoices.extraction import InvoiceProcessor
+from invoices.jobs import claim_jobs, complete_jobs, extend_leases, fail_job
+from invoices.models import ExtractionWorker
+
+
+class Command(BaseCommand):
+    """
+    Long-running extraction worker fed by the ExtractionJob queue table.
+
+    Start it N times (processes on one machine or on several hosts sharing
+    the database) to scale out; every worker keeps one resident extractor,
+    so model loading is paid once per process, not per invoice.
+
+    - Jobs are claimed in batches with a lease; a heartbeat thread extends
+      the leases and records throughput on the worker's ExtractionWorker row
+    - If a worker dies, its leases run out and other workers pick the jobs up
+    - Each batch's results are written synchronously through a ResultWriteBatcher;
+      only jobs whose rows were actually stored are marked done
+    """
+    help = "Run an extraction worker that claims queued jobs until stopped"
+
+    def add_arguments(self, parser):
+        parser.add_argument('--worker-id', default=f"{socket.gethostname()}-{os.getpid()}",
+                            help="Unique worker name (default: <hostname>-<pid>)")
+        parser.add_argument('--batch-size', type=int, default=8,
+                            help="Jobs claimed at a time (default: 8)")
+        parser.add_argument('--lease-seconds', type=int, default=120,
+                            help="How long a claim lasts without a heartbeat (default: 120)")
+        parser.add_argument('--heartbeat-interval', type=float, default=15,
+                            help="Seconds between heartbeats (default: 15)")
+        parser.add_argument('--poll-interval', type=float, default=2,
+                            help="Seconds to sleep when the queue is empty (default: 2)")
+        parser.add_argument('--max-attempts', type=int, default=3,
+                            help="Attempts before a job is failed for good (default: 3)")
+        parser.add_argument('--mode', choices=['text', 'layout'],
+                            help="Extraction mode (default: EXTRACTION_MODE setting)")
+        parser.add_argument('--once', action='store_true',
+                            help="Exit once the queue is empty instead of polling")
+
+    def handle(self, *args, **options):
+        self.options = options
+        self.worker_id = options['worker_id']
+        self.stop = threading.Event()
+        self.stats_lock = threading.Lock()
+        self.jobs_done = self.jobs_failed = 0
+        self.busy_seconds = 0.0
+
+        for sig in (signal.SIGTERM, signal.SIGINT):
+            signal.signal(sig, self._request_stop)
+
+        processor = InvoiceProcessor(mode=options['mode'])  # Resident for the worker's lifetime
+
+        self._register()
+        heartbeat = threading.Thread(target=self._heartbeat, name='worker-heartbeat', daemon=True)
+        heartbeat.start()
+        self.stdout.write(f"Worker {self.worker_id} started")
+
+        try:
+            while not self.stop.is_set():
+                jobs = claim_jobs(self.worker_id, options['batch_size'],
+                                  options['lease_seconds'], options['max_attempts'])
+                if not jobs:
+                    if options['once']:
+                        break
+                    self.stop.wait(options['poll_interval'])
+                    continue
+                self._run_batch(processor, jobs)
+        finally:
+            self.stop.set()
+            heartbeat.join()
+            self._record_stats(stopped_at=timezone.now())
+
+        self.stdout.write(self.style.SUCCESS(
+            f"Worker {self.worker_id} stopped: {self.jobs_done} done, {self.jobs_failed} failed"
+        ))
+
+    def _register(self):
+        now = timezone.now()
+        fields = {
+            'hostname': socket.gethostname(), 'pid': os.getpid(),
+            'started_at': now, 'last_heartbeat': now, 'stopped_at': None,
+            'jobs_done': 0, 'jobs_failed': 0, 'busy_seconds': 0.0,
+        }
+        # Plain UPDATE then INSERT rather than update_or_create: its read-then-write
+        # transaction can't take SQLite's write lock while other workers hold it
+        if not ExtractionWorker.objects.filter(worker_id=self.worker_id).update(**fields):
+            ExtractionWorker.objects.create(worker_id=self.worker_id, **fields)
+
+    def _run_batch(self, processor, jobs):
+        # No background flushes: this batch's rows are written by our flush() only
+        writer = ResultWriteBatcher(batch_size=len(jobs), background=False)
+        extracted = []
+        for job in jobs:
+            start = time.perf_counter()
+            try:
+                with job.invoice.original_file.open('rb') as pdf_file:
+                    result = processor.process_invoice(pdf_file)
+                if result.error:
+                    raise RuntimeError(result.error)
+                result.apply_to(job.invoice)
+                writer.submit(job.invoice)
+                extracted.append(job)
+            except Exception as e:
+                self._fail(job, str(e))
+            finally:
+                with self.stats_lock:
+                    self.busy_seconds += time.perf_counter() - start
+
+        if not extracted:
+            return
+        try:
+            written = writer.flush()  # Results must be stored before the jobs count as done
+        except OperationalError as e:
+            for job in extracted:
+                self._fail(job, f"Saving results failed: {e}")
+            return
+
+        # Rows that couldn't be stored fail on their own; the rest of the batch is fine
+        rejected = writer.pop_rejected()
+        saved = []
+        for job in extracted:
+            if job.invoice_id in rejected:
+                self._fail(job, f"Saving result failed: {rejected[job.invoice_id]}")
+            else:
+                saved.append(job)
+
+        if written != len(saved):
+            for job in saved:
+                self._fail(job, f"Saved {written} results for {len(saved)} jobs")
+            return
+
+        done = complete_jobs(self.worker_id, [job.pk for job in saved])
+        with self.stats_lock:
+            self.jobs_done += done
+        self.stdout.write(f"{self.worker_id}: completed {done}/{len(jobs)} jobs")
+
+    def _fail(self, job, error):
+        final = fail_job(self.worker_id, job, error, self.options['max_attempts'])
+        self.stderr.write(f"{self.worker_id}: job {job.pk} failed "
+                          f"({'giving up' if final else 'will retry'}): {error}")
+        if final:
+            with self.stats_lock:
+                self.jobs_failed += 1
+
+    def _heartbeat(self):
+        try:
+            while not self.stop.wait(self.options['heartbeat_interval']):
+                try:
+                    extend_leases(self.worker_id, self.options['lease_seconds'])
+                    self._record_stats()
+                except OperationalError as e:
+                    self.stderr.write(f"{self.worker_id}: heartbeat failed, will retry: {e}")
+        finally:
+            connections['default'].close()  # This thread's connection
+
+    def _record_stats(self, **extra):
+        with self.stats_lock:
+            stats = {'jobs_done': self.jobs_done, 'jobs_failed': self.jobs_failed,
+                     'busy_seconds': self.busy_seconds}
+        ExtractionWorker.objects.filter(worker_id=self.worker_id).update(
+            last_heartbeat=timezone.now(), **stats, **extra)
+
+    def _request_stop(self, signum, frame):
+        self.stdout.write(f"{self.worker_id}: signal {signum}, finishing current batch")
+        self.stop.set()
@@ -0,0 +1,33 @@
+# Generated by Django 4.2.7 on 2026-10-19 10:00
+
+from django.db import migrations, models
+import invoices.storage
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("invoices", "0002_alter_invoice_user"),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name="StoredBlob",
+            fields=[
+                (
+                    "name",
+                    models.CharField(max_length=255, primary_key=True, serialize=False),
+                ),
+                ("size", models.BigIntegerField(default=0)),
+                ("ref_count", models.PositiveIntegerField(default=0)),
+                ("created_at", models.DateTimeField(auto_now_add=True)),
+            ],
+        ),
+        migrations.AlterField(
+            model_name="invoice",
+            name="original_file",
+            field=models.FileField(
+                storage=invoices.storage.select_invoice_storage, upload_to="invoices/"
+            ),
+        ),
+    ]
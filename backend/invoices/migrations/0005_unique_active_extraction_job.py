@@ -0,0 +1,41 @@
+# Generated by Django 4.2.7 on 2026-10-19 10:17
+
+from django.db import migrations, models
+from django.utils import timezone
+
+
+def fail_duplicate_active_jobs(apps, schema_editor):
+    """Keep the oldest waiting/running job per invoice so the constraint can be added."""
+    ExtractionJob = apps.get_model("invoices", "ExtractionJob")
+    jobs = ExtractionJob.objects.using(schema_editor.connection.alias)
+    kept = {}
+    active = jobs.filter(status__in=["pending", "running"]).order_by("created_at", "pk")
+    for job in active:
+        if job.invoice_id not in kept:
+            kept[job.invoice_id] = job.pk
+            continue
+        jobs.filter(pk=job.pk).update(
+            status="failed",
+            error=f"Duplicate of job {kept[job.invoice_id]}",
+            finished_at=timezone.now(),
+            lease_expires_at=None,
+        )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("invoices", "0004_extraction_jobs"),
+    ]
+
+    operations = [
+        migrations.RunPython(fail_duplicate_active_jobs, migrations.RunPython.noop),
+        migrations.AddConstraint(
+            model_name="extractionjob",
+            constraint=models.UniqueConstraint(
+                condition=models.Q(("status__in", ["pending", "running"])),
+                fields=("invoice",),
+                name="unique_active_extraction_job",
+            ),
+        ),
+    ]
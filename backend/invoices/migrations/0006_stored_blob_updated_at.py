@@ -0,0 +1,19 @@
+# Generated by Django 4.2.7 on 2026-10-19 10:24
+
+from django.db import migrations, models
+import django.utils.timezone
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("invoices", "0005_unique_active_extraction_job"),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name="storedblob",
+            name="updated_at",
+            field=models.DateTimeField(default=django.utils.timezone.now),
+        ),
+    ]
@@ -0,0 +1,50 @@
+import json
+
+from django.core.serializers.json import DjangoJSONEncoder
+from rest_framework.renderers import BaseRenderer
+
+
+def sse_event(event: str, data) -> str:
+    """Format one Server-Sent Events frame with a JSON payload."""
+    payload = json.dumps(data, cls=DjangoJSONEncoder)
+    return f"event: {event}\ndata: {payload}\n\n"
+
+
+class EventStreamRenderer(BaseRenderer):
+    """
+    Lets DRF negotiate `Accept: text/event-stream` (what EventSource sends).
+
+    Streaming endpoints return a StreamingHttpResponse directly; this renderer
+    only kicks in for plain Responses such as 404s or validation errors,
+    which are sent as a single `error` event.
+    """
+    media_type = 'text/event-stream'
+    format = 'sse'
+    charset = 'utf-8'
+
+    def render(self, data, accepted_media_type=None, renderer_context=None):
+        if data is None:
+            return b''
+        return sse_event('error', data).encode(self.charset)
+
+
+def ndjson_line(data) -> str:
+    """Format one newline-delimited JSON record."""
+    return json.dumps(data, cls=DjangoJSONEncoder) + "\n"
+
+
+class NDJSONRenderer(BaseRenderer):
+    """
+    Lets DRF negotiate `Accept: application/x-ndjson` for line-streamed results.
+
+    Like EventStreamRenderer, only plain Responses (errors) go through here;
+    they become a single JSON line.
+    """
+    media_type = 'application/x-ndjson'
+    format = 'ndjson'
+    charset = 'utf-8'
+
+    def render(self, data, accepted_media_type=None, renderer_context=None):
+        if data is None:
+            return b''
+        return ndjson_line(data).encode(self.charset)
@@ -0,0 +1,16 @@
+from django.db import transaction
+from django.db.models.signals import post_delete
+from django.dispatch import receiver
+
+from .models import Invoice
+from .storage import ContentAddressedStorage
+
+
+@receiver(post_delete, sender=Invoice)
+def release_invoice_blob(sender, instance, using, **kwargs):
+    """Drop the deleted invoice's reference to its deduplicated upload."""
+    storage = instance.original_file.storage
+    name = instance.original_file.name
+    if name and isinstance(storage, ContentAddressedStorage):
+        # Only once the delete commits: a rolled-back cascade must keep its files
+        transaction.on_commit(lambda: storage.delete(name), using=using)
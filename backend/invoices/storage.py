@@ -0,0 +1,132 @@
+import gzip
+import hashlib
+import io
+import os
+import tempfile
+
+from django.conf import settings
+from django.core.files import File
+from django.core.files.storage import FileSystemStorage, default_storage
+from django.db import transaction
+from django.utils._os import safe_join
+
+
+class ContentAddressedStorage(FileSystemStorage):
+    """
+    Deduplicating file storage for uploaded invoices.
+
+    - Files are stored once per content hash under sharded directories:
+      blobs/ab/cd/abcd1234...pdf (or .pdf.gz when compressed at rest)
+    - Every save of an already-stored blob only bumps its reference count
+      (StoredBlob row); delete() only removes the file at zero references
+    - Orphans left behind by failed uploads are cleaned up by `manage.py gc_blobs`
+    """
+
+    def __init__(self, prefix: str = 'blobs', compress: bool = False, **kwargs):
+        super().__init__(**kwargs)
+        self.prefix = prefix
+        self.compress = compress
+
+    def blob_name(self, digest: str, extension: str) -> str:
+        """Storage name for a blob: prefix/ab/cd/<digest><ext>[.gz]"""
+        name = f"{self.prefix}/{digest[:2]}/{digest[2:4]}/{digest}{extension}"
+        return name + '.gz' if self.compress else name
+
+    def is_blob(self, name: str) -> bool:
+        return name.startswith(self.prefix + '/')
+
+    def get_available_name(self, name, max_length=None):
+        # Names are content hashes, so an existing name is the same file
+        return name
+
+    def _save(self, name, content):
+        from .models import StoredBlob
+
+        extension = os.path.splitext(name)[1].lower()
+        directory = safe_join(self.location, self.prefix)
+        os.makedirs(directory, exist_ok=True)
+
+        # Hash and write to a temp file in one pass, then move it into place
+        digest = hashlib.sha256()
+        size = 0
+        fd, temp_path = tempfile.mkstemp(dir=directory, suffix='.upload')
+        try:
+            with os.fdopen(fd, 'wb') as raw:
+                out = gzip.GzipFile(fileobj=raw, mode='wb') if self.compress else raw
+                for chunk in content.chunks():
+                    digest.update(chunk)
+                    size += len(chunk)
+                    out.write(chunk)
+                if self.compress:
+                    out.close()
+
+            blob_name = self.blob_name(digest.hexdigest(), extension)
+            full_path = safe_join(self.location, blob_name)
+
+            # The reference and the file check happen under the blob's row lock,
+            # so a concurrent delete() can't remove the file in between
+            with transaction.atomic():
+                StoredBlob.acquire(blob_name, size)
+                if os.path.exists(full_path):
+                    print(f"Duplicate upload, reusing {blob_name}")
+                    os.utime(full_path)  # Fresh mtime keeps gc_blobs --min-age away from it
+                else:
+                    os.makedirs(os.path.dirname(full_path), exist_ok=True)
+                    os.replace(temp_path, full_path)
+                    if self.file_permissions_mode is not None:
+                        os.chmod(full_path, self.file_permissions_mode)
+        finally:
+            if os.path.exists(temp_path):
+                os.remove(temp_path)
+
+        return blob_name
+
+    def _open(self, name, mode='rb'):
+        if name.endswith('.gz') and self.is_blob(name):
+            with gzip.open(safe_join(self.location, name), 'rb') as compressed:
+                return File(io.BytesIO(compressed.read()), name=name)
+        return super()._open(name, mode)
+
+    def path(self, name):
+        if name.endswith('.gz') and self.is_blob(name):
+            raise NotImplementedError("Compressed blobs have no plain local path; use open()")
+        return super().path(name)
+
+    def exists(self, name):
+        return os.path.lexists(self.blob_path(name))
+
+    def size(self, name):
+        if name.endswith('.gz') and self.is_blob(name):
+            from .models import StoredBlob
+            blob = StoredBlob.objects.filter(name=name).first()
+            # Report the uncompressed size callers expect, if we know it
+            return blob.size if blob else os.path.getsize(self.blob_path(name))
+        return super().size(name)
+
+    def delete(self, name):
+        from .models import StoredBlob
+
+        if not self.is_blob(name):
+            return super().delete(name)
+        # Remove the file while still holding the row lock taken by release()
+        with transaction.atomic():
+            if StoredBlob.release(name) <= 0:
+                try:
+                    os.remove(self.blob_path(name))
+                except FileNotFoundError:
+                    pass
+
+    def blob_path(self, name: str) -> str:
+        """On-disk path of a blob, compressed or not (for maintenance commands)"""
+        return safe_join(self.location, name)
+
+
+def select_invoice_storage():
+    """Storage for Invoice.original_file, picked from the INVOICE_STORAGE setting."""
+    config = getattr(settings, 'INVOICE_STORAGE', {})
+    if not config.get('DEDUPLICATE', False):
+        return default_storage
+    return ContentAddressedStorage(
+        prefix=config.get('PREFIX', 'blobs'),
+        compress=config.get('COMPRESS', False),
+    )
@@ -1,3 +1,834 @@
-from django.test import TestCase
+import io
+import json
+import os
+import shutil
+import tempfile
+import threading
+import time
+from datetime import date, timedelta
+from decimal import Decimal
+from unittest import mock
 
-# Create your tests here.
+from django.core.files.base import ContentFile
+from django.core.management import call_command
+from django.db import IntegrityError, OperationalError, transaction
+from django.test import SimpleTestCase, TestCase, TransactionTestCase, override_settings
+from django.utils import timezone
+from rest_framework.test import APIClient
+
+from .admission import AdmissionController, AdmissionRejected
+from .db import ResultWriteBatcher
+from .extraction import (
+    EXTRACTED_FIELDS, BERTExtractor, ExtractionResult, FieldCandidate, InvoiceProcessor,
+)
+from .extraction.layout import LayoutExtractor, LayoutIndex, build_words
+from .jobs import claim_jobs, complete_jobs, enqueue_extraction, extend_leases, fail_job
+from .models import ExtractionJob, ExtractionWorker, Invoice, StoredBlob
+from .storage import ContentAddressedStorage
+
+
+def use_temp_media_root(test):
+    """Point MEDIA_ROOT at a fresh directory for the duration of one test."""
+    media_root = tempfile.mkdtemp(prefix='invoice-test-')
+    test.addCleanup(shutil.rmtree, media_root, ignore_errors=True)
+    settings_override = override_settings(MEDIA_ROOT=media_root)
+    settings_override.enable()
+    test.addCleanup(settings_override.disable)
+    return media_root
+
+
+class AdmissionControllerTests(SimpleTestCase):
+    """Concurrency limit, bounded queue and per-user fair share."""
+
+    def _queue_in_background(self, controller, user_key):
+        """Start a thread blocked in acquire(); returns (thread, outcome list)."""
+        outcome = []
+
+        def run():
+            try:
+                controller.acquire(user_key)
+                outcome.append('admitted')
+                controller.release(user_key)
+            except AdmissionRejected as e:
+                outcome.append(e.status_code)
+
+        thread = threading.Thread(target=run)
+        thread.start()
+        for _ in range(200):
+            if controller.snapshot()['queued']:
+                break
+            time.sleep(0.005)
+        return thread, outcome
+
+    def test_slot_admits_and_releases(self):
+        controller = AdmissionController(max_concurrent=2)
+        with controller.slot('user:1'):
+            self.assertEqual(controller.snapshot()['in_flight'], 1)
+        snapshot = controller.snapshot()
+        self.assertEqual(snapshot['in_flight'], 0)
+        self.assertEqual(snapshot['active_users'], 0)
+        self.assertEqual(snapshot['admitted_total'], 1)
+
+    def test_per_user_limit_is_429(self):
+        controller = AdmissionController(max_concurrent=4, max_per_user=1, retry_after=7)
+        controller.acquire('user:1')
+        with self.assertRaises(AdmissionRejected) as ctx:
+            controller.acquire('user:1')
+        self.assertEqual(ctx.exception.status_code, 429)
+        self.assertEqual(ctx.exception.retry_after, 7)
+
+        # Other users are unaffected
+        controller.acquire('user:2')
+        self.assertEqual(controller.snapshot()['in_flight'], 2)
+
+    def test_queued_request_is_admitted_when_a_slot_frees(self):
+        controller = AdmissionController(max_concurrent=1, max_queued=1, queue_timeout=5)
+        controller.acquire('user:1')
+        thread, outcome = self._queue_in_background(controller, 'user:2')
+        self.assertEqual(controller.snapshot()['queued'], 1)
+
+        controller.release('user:1')
+        thread.join(5)
+        self.assertEqual(outcome, ['admitted'])
+        self.assertEqual(controller.snapshot()['in_flight'], 0)
+
+    def test_full_queue_is_503(self):
+        controller = AdmissionController(max_concurrent=1, max_queued=1, queue_timeout=5)
+        controller.acquire('user:1')
+        thread, outcome = self._queue_in_background(controller, 'user:2')
+
+        with self.assertRaises(AdmissionRejected) as ctx:
+            controller.acquire('user:3')
+        self.assertEqual(ctx.exception.status_code, 503)
+
+        controller.release('user:1')
+        thread.join(5)
+        self.assertEqual(outcome, ['admitted'])
+        self.assertEqual(controller.snapshot()['rejected_total'], 1)
+
+    def test_queue_timeout_is_503_and_forgets_the_user(self):
+        controller = AdmissionController(max_concurrent=1, max_queued=1, queue_timeout=0.05)
+        controller.acquire('user:1')
+        with self.assertRaises(AdmissionRejected) as ctx:
+            controller.acquire('user:2')
+        self.assertEqual(ctx.exception.status_code, 503)
+
+        snapshot = controller.snapshot()
+        self.assertEqual(snapshot['queued'], 0)
+        self.assertEqual(snapshot['active_users'], 1)  # Only user:1, still running
+
+
+class ExtractionResultTests(SimpleTestCase):
+    """Typed results from the regex path: values, spans and what gets saved."""
+
+    TEXT = (
+        "ACME Corp\n"
+        "Invoice Number: INV-2024-001\n"
+        "Invoice Date: 01/15/2024\n"
+        "Due Date: 02/14/2024\n"
+        "Total Due: $1,234.50\n"
+    )
+
+    def setUp(self):
+        with mock.patch.dict('sys.modules', {'transformers': None}):  # Regex path only
+            self.extractor = BERTExtractor()
+        self.assertIsNone(self.extractor.bert_ner)
+        self.result = self.extractor.extract_information(self.TEXT)
+
+    def test_values_and_spans_select_the_matched_text(self):
+        expected = {
+            'invoice_number': ('INV-2024-001', 'INV-2024-001'),
+            'invoice_date': (date(2024, 1, 15), '01/15/2024'),
+            'due_date': (date(2024, 2, 14), '02/14/2024'),
+            'amount': (1234.5, '$1,234.50'),
+        }
+        for field, (value, matched) in expected.items():
+            with self.subTest(field=field):
+                candidate = getattr(self.result, field)
+                self.assertEqual(candidate.value, value)
+                self.assertEqual(self.TEXT[candidate.start:candidate.end], matched)
+
+        self.assertFalse(self.result.bert_available)
+        self.assertGreater(self.result.confidence_score, 0)
+
+    def test_provenance_covers_found_fields(self):
+        provenance = self.result.provenance()
+        self.assertEqual(set(provenance), {'invoice_number', 'invoice_date', 'due_date', 'amount'})
+        self.assertEqual(provenance['invoice_number']['method'], 'regex_fallback')
+        self.assertEqual(provenance['amount']['start'], self.result.amount.start)
+
+    def test_apply_to_sets_exactly_the_extracted_fields(self):
+        invoice = Invoice(original_file='bill.pdf')
+        self.assertEqual(self.result.apply_to(invoice), EXTRACTED_FIELDS)
+
+        self.assertEqual(invoice.invoice_number, 'INV-2024-001')
+        self.assertEqual(invoice.invoice_date, date(2024, 1, 15))
+        self.assertEqual(invoice.due_date, date(2024, 2, 14))
+        self.assertEqual(invoice.amount, 1234.5)
+        self.assertEqual(invoice.confidence_score, self.result.confidence_score)
+        self.assertEqual(invoice.original_file.name, 'bill.pdf')
+
+    def test_missing_fields_are_none(self):
+        result = self.extractor.extract_information("Nothing to see here")
+        self.assertIsNone(result.amount)
+        self.assertIsNone(result.value('amount'))
+        self.assertNotIn('amount', result.provenance())
+
+
+def word_box(text, x0, top):
+    """A pdfplumber-style word dict, 6pt per character and 10pt high."""
+    return {'text': text, 'x0': x0, 'top': top, 'x1': x0 + 6 * len(text), 'bottom': top + 10}
+
+
+class LayoutTests(SimpleTestCase):
+    """Word boxes, label lookup and nearest-value resolution for layout mode."""
+
+    INVOICE = [
+        word_box('$99.00', 200, 201),  # Out of order and a little off the line on purpose
+        word_box('Total', 10, 200),
+        word_box('$123,456,789,012.00', 60, 200),
+        word_box('Invoice', 10, 50), word_box('#INV-7', 60, 50),
+        word_box('Invoice', 10, 110), word_box('Date:', 60, 110), word_box('01/15/2024', 100, 110),
+        word_box('Due', 10, 140), word_box('Date', 40, 140),
+        word_box('02/14/2024', 10, 155),
+    ]
+
+    def setUp(self):
+        self.text, self.words = build_words([(1, self.INVOICE)])
+        self.index = LayoutIndex(self.words)
+
+    def _word(self, text):
+        return next(w for w in self.words if w.text == text)
+
+    def test_build_words_groups_lines_and_records_offsets(self):
+        self.assertEqual(self.text.splitlines(), [
+            'Invoice # INV-7',
+            'Invoice Date: 01/15/2024',
+            'Due Date',
+            '02/14/2024',
+            'Total $123,456,789,012.00 $99.00',
+        ])
+        for word in self.words:
+            self.assertEqual(self.text[word.offset:word.end], word.text)
+
+    def test_split_hash_separates_the_marker(self):
+        marker, number = self._word('#'), self._word('INV-7')
+        self.assertEqual(marker.x0, 60)
+        self.assertEqual(marker.x1, number.x0)
+        self.assertEqual(number.x1, 60 + 6 * len('#INV-7'))
+
+    def test_find_label_matches_words_on_one_line_only(self):
+        matches = self.index.find_label('invoice #')
+        self.assertEqual([(first.top, last.text) for first, last in matches], [(50, '#')])
+        self.assertEqual(len(self.index.find_label('due date')), 1)
+        self.assertEqual(self.index.find_label('date 02/14/2024'), [])  # Next word is a line below
+
+    def test_right_of_and_below_are_nearest_first(self):
+        self.assertEqual([w.text for w in self.index.right_of(self._word('Total'))],
+                         ['$123,456,789,012.00', '$99.00'])
+        self.assertEqual(self.index.right_of(self._word('Date')), [])
+        self.assertEqual([w.text for w in self.index.below(self._word('Due'), self._word('Date'))][:1],
+                         ['02/14/2024'])
+
+    def test_extract_resolves_fields_and_skips_out_of_range_amounts(self):
+        result = LayoutExtractor().extract(self.index)
+
+        self.assertEqual(result.value('amount'), 99.0)  # $123bn skipped, next candidate used
+        self.assertEqual(result.value('invoice_number'), 'INV-7')
+        self.assertEqual(result.value('invoice_date'), date(2024, 1, 15))
+        self.assertEqual(result.value('due_date'), date(2024, 2, 14))
+        self.assertEqual(result.due_date.score, 0.8)  # Found below the label, not beside it
+        self.assertEqual(result.amount.method, 'layout')
+        self.assertEqual(self.text[result.amount.start:result.amount.end], '$99.00')
+
+    def test_account_number_is_not_an_invoice_number(self):
+        _, words = build_words([(1, [word_box('Account', 10, 50), word_box('Number', 60, 50),
+                                     word_box('99887766', 110, 50)])])
+        self.assertIsNone(LayoutExtractor().extract(LayoutIndex(words)).invoice_number)
+
+
+class ContentAddressedStorageTests(TestCase):
+    """Deduplication and reference counting of uploaded invoices."""
+
+    def setUp(self):
+        self.media_root = tempfile.mkdtemp(prefix='invoice-storage-test-')
+        self.addCleanup(shutil.rmtree, self.media_root, ignore_errors=True)
+        self.storage = ContentAddressedStorage(location=self.media_root)
+
+    def _save(self, content=b'%PDF-1.4 same bytes', name='bill.pdf'):
+        return self.storage.save(name, ContentFile(content))
+
+    def _refs(self, name):
+        return StoredBlob.objects.get(name=name).ref_count
+
+    def test_duplicate_upload_shares_one_file(self):
+        first = self._save(name='a.pdf')
+        second = self._save(name='b.pdf')
+
+        self.assertEqual(first, second)
+        self.assertTrue(first.startswith('blobs/'))
+        self.assertEqual(self._refs(first), 2)
+        blobs = [f for _, _, files in os.walk(self.media_root) for f in files]
+        self.assertEqual(len(blobs), 1)
+
+    def test_duplicate_upload_refreshes_mtime(self):
+        name = self._save()
+        path = self.storage.blob_path(name)
+        os.utime(path, (0, 0))
+
+        self._save()
+        self.assertGreater(os.path.getmtime(path), time.time() - 60)
+
+    def test_delete_removes_file_with_last_reference(self):
+        name = self._save()
+        self._save()
+        path = self.storage.blob_path(name)
+
+        self.storage.delete(name)
+        self.assertTrue(os.path.exists(path))
+        self.assertEqual(self._refs(name), 1)
+
+        self.storage.delete(name)
+        self.assertFalse(os.path.exists(path))
+        self.assertEqual(self._refs(name), 0)
+
+    def test_reupload_after_delete_restores_file(self):
+        name = self._save()
+        self.storage.delete(name)
+
+        self.assertEqual(self._save(), name)
+        self.assertTrue(os.path.exists(self.storage.blob_path(name)))
+        self.assertEqual(self._refs(name), 1)
+
+    def test_compressed_blob_round_trips(self):
+        storage = ContentAddressedStorage(location=self.media_root, compress=True)
+        name = storage.save('bill.pdf', ContentFile(b'%PDF-1.4 compressed'))
+
+        self.assertTrue(name.endswith('.pdf.gz'))
+        with storage.open(name) as blob:
+            self.assertEqual(blob.read(), b'%PDF-1.4 compressed')
+        self.assertEqual(storage.size(name), len(b'%PDF-1.4 compressed'))
+
+
+class InvoiceBlobReleaseTests(TestCase):
+    """Deleting an invoice releases its blob, but only once the delete commits."""
+
+    def setUp(self):
+        self.media_root = use_temp_media_root(self)
+
+        storage = Invoice._meta.get_field('original_file').storage
+        if not isinstance(storage, ContentAddressedStorage):
+            self.skipTest("Invoice storage is not deduplicating")
+
+        self.invoice = Invoice.objects.create(
+            original_file=ContentFile(b'%PDF-1.4 invoice', name='bill.pdf'))
+        self.name = self.invoice.original_file.name
+        self.path = storage.blob_path(self.name)
+
+    def test_delete_releases_blob_on_commit(self):
+        with self.captureOnCommitCallbacks(execute=True):
+            self.invoice.delete()
+        self.assertFalse(os.path.exists(self.path))
+        self.assertEqual(StoredBlob.objects.get(name=self.name).ref_count, 0)
+
+    def test_rolled_back_delete_keeps_blob(self):
+        with self.captureOnCommitCallbacks(execute=True) as callbacks:
+            try:
+                with transaction.atomic():
+                    self.invoice.delete()
+                    raise RuntimeError("roll back")
+            except RuntimeError:
+                pass
+
+        self.assertEqual(callbacks, [])
+        self.assertTrue(os.path.exists(self.path))
+        self.assertEqual(StoredBlob.objects.get(name=self.name).ref_count, 1)
+
+
+class GcBlobsCommandTests(TestCase):
+    """gc_blobs reconciles settled blobs and leaves recently touched ones alone."""
+
+    def setUp(self):
+        use_temp_media_root(self)
+        self.storage = Invoice._meta.get_field('original_file').storage
+        if not isinstance(self.storage, ContentAddressedStorage):
+            self.skipTest("Invoice storage is not deduplicating")
+
+        self.invoice = Invoice.objects.create(
+            original_file=ContentFile(b'%PDF-1.4 kept', name='bill.pdf'))
+        self.name = self.invoice.original_file.name
+
+    def _gc(self, *args):
+        out = io.StringIO()
+        call_command('gc_blobs', *args, stdout=out, stderr=io.StringIO())
+        return out.getvalue()
+
+    def _age(self, name, seconds=7200):
+        StoredBlob.objects.filter(name=name).update(updated_at=timezone.now() - timedelta(seconds=seconds))
+        old = time.time() - seconds
+        os.utime(self.storage.blob_path(name), (old, old))
+
+    def _refs(self, name):
+        return StoredBlob.objects.get(name=name).ref_count
+
+    def test_settled_ref_count_is_reconciled(self):
+        StoredBlob.objects.filter(name=self.name).update(ref_count=5)
+        self._age(self.name)
+
+        self.assertIn("Fixed 1 reference counts", self._gc())
+        self.assertEqual(self._refs(self.name), 1)
+        self.assertTrue(os.path.exists(self.storage.blob_path(self.name)))
+
+    def test_in_flight_reference_is_kept(self):
+        # A duplicate upload has acquired the blob but its invoice isn't committed yet
+        StoredBlob.acquire(self.name, 0)
+        self._gc()
+        self.assertEqual(self._refs(self.name), 2)
+
+        # Once settled (the upload never committed), the count is corrected
+        self._age(self.name)
+        self._gc()
+        self.assertEqual(self._refs(self.name), 1)
+
+    def test_orphaned_files_are_removed_once_old(self):
+        orphan = self.storage.save('orphan.pdf', ContentFile(b'%PDF-1.4 orphan'))
+        StoredBlob.objects.filter(name=orphan).update(ref_count=0)
+        self._gc()
+        self.assertTrue(os.path.exists(self.storage.blob_path(orphan)))  # Too recent
+
+        self._age(orphan)
+        self._age(self.name)
+        self._gc()
+        self.assertFalse(os.path.exists(self.storage.blob_path(orphan)))
+        self.assertFalse(StoredBlob.objects.filter(name=orphan).exists())
+        self.assertTrue(os.path.exists(self.storage.blob_path(self.name)))
+
+    def test_dry_run_changes_nothing(self):
+        orphan = self.storage.save('orphan.pdf', ContentFile(b'%PDF-1.4 orphan'))
+        StoredBlob.objects.filter(name__in=[orphan, self.name]).update(ref_count=3)
+        self._age(orphan)
+        self._age(self.name)
+
+        output = self._gc('--dry-run')
+        self.assertIn("[dry run] Fixed 2 reference counts, removed 1 orphaned blobs", output)
+        self.assertEqual(self._refs(self.name), 3)
+        self.assertTrue(os.path.exists(self.storage.blob_path(orphan)))
+
+
+class ResultWriteBatcherTests(TestCase):
+    """Batched result writes, retries and bad-row isolation."""
+
+    def setUp(self):
+        self.invoices = [Invoice.objects.create(original_file=f'bench/{i}.pdf') for i in range(3)]
+
+    def _result(self, invoice, amount):
+        invoice.amount = amount
+        invoice.invoice_number = f"INV-{invoice.pk}"
+        invoice.invoice_date = date(2024, 1, 5)
+        invoice.extraction_method = 'regex'
+        return invoice
+
+    def test_flush_writes_extracted_columns_only(self):
+        writer = ResultWriteBatcher(background=False)
+        invoice = self._result(self.invoices[0], Decimal('12.50'))
+        invoice.original_file = 'changed.pdf'  # Not an extracted field
+        writer.submit(invoice)
+
+        self.assertEqual(writer.flush(), 1)
+        saved = Invoice.objects.get(pk=invoice.pk)
+        self.assertEqual(saved.amount, Decimal('12.50'))
+        self.assertEqual(saved.invoice_number, f"INV-{invoice.pk}")
+        self.assertEqual(saved.original_file.name, 'bench/0.pdf')
+
+    def test_resubmitting_keeps_latest_result(self):
+        writer = ResultWriteBatcher(background=False)
+        writer.submit(self._result(Invoice.objects.get(pk=self.invoices[0].pk), Decimal('1.00')))
+        writer.submit(self._result(Invoice.objects.get(pk=self.invoices[0].pk), Decimal('2.00')))
+
+        self.assertEqual(writer.flush(), 1)
+        self.assertEqual(Invoice.objects.get(pk=self.invoices[0].pk).amount, Decimal('2.00'))
+
+    def test_operational_error_requeues_batch(self):
+        writer = ResultWriteBatcher(background=False)
+        for invoice in self.invoices:
+            writer.submit(self._result(invoice, Decimal('5.00')))
+
+        real_write = writer._write
+        calls = []
+
+        def locked_once(batch):
+            calls.append(len(batch))
+            if len(calls) == 1:
+                raise OperationalError("database is locked")
+            return real_write(batch)
+
+        with mock.patch.object(writer, '_write', side_effect=locked_once):
+            with self.assertRaises(OperationalError):
+                writer.flush()
+            self.assertEqual(writer.failures, 1)
+            self.assertEqual(writer.flush(), 3)
+
+        self.assertEqual(calls, [3, 3])  # Whole batch retried, not row by row
+        self.assertEqual(Invoice.objects.filter(amount=Decimal('5.00')).count(), 3)
+        self.assertEqual(writer.flush(), 0)
+
+    def test_bad_row_is_rejected_and_rest_written(self):
+        writer = ResultWriteBatcher(background=False)
+        good, bad, other = self.invoices
+        writer.submit(self._result(good, Decimal('10.00')))
+        writer.submit(self._result(bad, 123456789012.0))  # Too big for max_digits=10
+        writer.submit(self._result(other, Decimal('30.00')))
+
+        self.assertEqual(writer.flush(), 2)
+        self.assertEqual(list(writer.pop_rejected()), [bad.pk])
+        self.assertEqual(writer.pop_rejected(), {})
+        self.assertEqual(Invoice.objects.get(pk=good.pk).amount, Decimal('10.00'))
+        self.assertEqual(Invoice.objects.get(pk=other.pk).amount, Decimal('30.00'))
+        self.assertIsNone(Invoice.objects.get(pk=bad.pk).amount)
+        self.assertEqual(writer.flush(), 0)  # Not retried forever
+
+
+class ResultWriteBatcherBackgroundTests(TransactionTestCase):
+    """The background writer keeps running after a failed flush."""
+
+    def test_writer_thread_survives_bad_rows(self):
+        good, bad, late = [Invoice.objects.create(original_file=f'bench/{i}.pdf') for i in range(3)]
+        writer = ResultWriteBatcher(batch_size=2, flush_interval=0.05)
+
+        good.amount, bad.amount = Decimal('10.00'), 123456789012.0
+        writer.submit(good)
+        writer.submit(bad)
+        for _ in range(200):
+            if writer.rejected:
+                break
+            time.sleep(0.01)
+        self.assertTrue(writer._thread.is_alive())
+
+        late.amount = Decimal('20.00')
+        writer.submit(late)
+        for _ in range(200):
+            if Invoice.objects.get(pk=late.pk).amount is not None:
+                break
+            time.sleep(0.01)
+        writer.close()
+
+        self.assertEqual(Invoice.objects.get(pk=good.pk).amount, Decimal('10.00'))
+        self.assertEqual(Invoice.objects.get(pk=late.pk).amount, Decimal('20.00'))
+        self.assertEqual(list(writer.pop_rejected()), [bad.pk])
+
+
+class ExtractionJobQueueTests(TestCase):
+    """Claiming, leases and retries on the ExtractionJob queue table."""
+
+    def setUp(self):
+        self.invoices = [Invoice.objects.create(original_file=f'bench/{i}.pdf') for i in range(3)]
+        self.jobs = [enqueue_extraction(invoice) for invoice in self.invoices]
+
+    def _expire(self, job, **fields):
+        ExtractionJob.objects.filter(pk=job.pk).update(
+            lease_expires_at=timezone.now() - timedelta(seconds=1), **fields)
+
+    def test_enqueue_reuses_active_job(self):
+        self.assertEqual(enqueue_extraction(self.invoices[0]).pk, self.jobs[0].pk)
+        self.assertEqual(ExtractionJob.objects.filter(invoice=self.invoices[0]).count(), 1)
+
+    def test_one_active_job_per_invoice_is_enforced(self):
+        with self.assertRaises(IntegrityError), transaction.atomic():
+            ExtractionJob.objects.create(invoice=self.invoices[0])
+
+        # Finished jobs don't count: the invoice can be queued again
+        ExtractionJob.objects.filter(pk=self.jobs[0].pk).update(status=ExtractionJob.STATUS_DONE)
+        self.assertNotEqual(enqueue_extraction(self.invoices[0]).pk, self.jobs[0].pk)
+
+    def test_claims_are_exclusive(self):
+        first = claim_jobs('w1', limit=2, lease_seconds=60, max_attempts=3)
+        second = claim_jobs('w2', limit=2, lease_seconds=60, max_attempts=3)
+
+        self.assertEqual([job.pk for job in first], [job.pk for job in self.jobs[:2]])
+        self.assertEqual([job.pk for job in second], [self.jobs[2].pk])
+        self.assertEqual(claim_jobs('w3', limit=2, lease_seconds=60, max_attempts=3), [])
+        for job in first + second:
+            self.assertEqual(job.status, ExtractionJob.STATUS_RUNNING)
+            self.assertEqual(job.attempts, 1)
+
+    def test_expired_lease_is_reclaimed(self):
+        job = claim_jobs('dead', limit=1, lease_seconds=60, max_attempts=3)[0]
+        claim_jobs('w1', limit=2, lease_seconds=60, max_attempts=3)  # Drains the rest
+        self.assertEqual(claim_jobs('w2', limit=1, lease_seconds=60, max_attempts=3), [])
+
+        self._expire(job)
+        reclaimed = claim_jobs('w2', limit=1, lease_seconds=60, max_attempts=3)
+        self.assertEqual([(j.pk, j.worker_id, j.attempts) for j in reclaimed], [(job.pk, 'w2', 2)])
+
+        # The crashed worker can no longer complete it
+        self.assertEqual(complete_jobs('dead', [job.pk]), 0)
+        self.assertEqual(complete_jobs('w2', [job.pk]), 1)
+
+    def test_heartbeat_keeps_lease_alive(self):
+        job = claim_jobs('w1', limit=1, lease_seconds=60, max_attempts=3)[0]
+        self._expire(job)
+        extend_leases('w1', lease_seconds=60)
+        claim_jobs('w2', limit=5, lease_seconds=60, max_attempts=3)
+        self.assertEqual(ExtractionJob.objects.get(pk=job.pk).worker_id, 'w1')
+
+    def test_job_fails_after_max_attempts(self):
+        job = claim_jobs('w1', limit=1, lease_seconds=60, max_attempts=2)[0]
+        self.assertFalse(fail_job('w1', job, "boom", max_attempts=2))
+        self.assertEqual(ExtractionJob.objects.get(pk=job.pk).status, ExtractionJob.STATUS_PENDING)
+
+        job = claim_jobs('w1', limit=1, lease_seconds=60, max_attempts=2)[0]
+        self.assertTrue(fail_job('w1', job, "boom", max_attempts=2))
+        self.assertEqual(ExtractionJob.objects.get(pk=job.pk).status, ExtractionJob.STATUS_FAILED)
+
+    def test_expired_lease_past_max_attempts_fails(self):
+        job = claim_jobs('dead', limit=1, lease_seconds=60, max_attempts=3)[0]
+        self._expire(job, attempts=3)
+
+        reclaimed = claim_jobs('w2', limit=5, lease_seconds=60, max_attempts=3)
+        self.assertNotIn(job.pk, [j.pk for j in reclaimed])
+        job.refresh_from_db()
+        self.assertEqual(job.status, ExtractionJob.STATUS_FAILED)
+        self.assertEqual(job.error, "Lease expired too many times")
+
+
+class EnqueueDeletedInvoiceTests(TransactionTestCase):
+    """Enqueueing an invoice that was deleted meanwhile fails once, not forever."""
+
+    def setUp(self):
+        self.invoice = Invoice.objects.create(original_file='bench/gone.pdf')
+        Invoice.objects.filter(pk=self.invoice.pk).delete()  # self.invoice is now stale
+
+    def test_enqueue_raises_for_deleted_invoice(self):
+        with mock.patch.object(ExtractionJob.objects, 'create', wraps=ExtractionJob.objects.create) as create:
+            with self.assertRaises(IntegrityError):
+                enqueue_extraction(self.invoice)
+        self.assertEqual(create.call_count, 1)
+        self.assertFalse(ExtractionJob.objects.exists())
+
+    def test_endpoint_returns_404_when_deleted_before_insert(self):
+        invoice = Invoice.objects.create(original_file='bench/racing.pdf')
+
+        def delete_then_enqueue(target):
+            Invoice.objects.filter(pk=target.pk).delete()  # A DELETE lands after get_object()
+            return enqueue_extraction(target)
+
+        with mock.patch('invoices.views.enqueue_extraction', side_effect=delete_then_enqueue):
+            response = APIClient().post(f'/api/invoices/{invoice.pk}/enqueue_extraction/')
+        self.assertEqual(response.status_code, 404)
+        self.assertFalse(ExtractionJob.objects.exists())
+
+
+class ExtractionWorkerCommandTests(TestCase):
+    """run_extraction_worker only marks jobs done once their results are stored."""
+
+    def setUp(self):
+        self.media_root = use_temp_media_root(self)
+
+        self.invoices = [
+            Invoice.objects.create(original_file=ContentFile(f'%PDF-1.4 {i}'.encode(), name=f'{i}.pdf'))
+            for i in range(3)
+        ]
+        for invoice in self.invoices:
+            enqueue_extraction(invoice)
+
+    def _run_worker(self, amounts):
+        self.stdout, self.stderr = io.StringIO(), io.StringIO()
+        processor = mock.Mock()
+        processor.process_invoice.side_effect = [
+            ExtractionResult(amount=FieldCandidate(amount, 'regex'), extraction_method='bert_extraction')
+            for amount in amounts
+        ]
+        with mock.patch('invoices.management.commands.run_extraction_worker.InvoiceProcessor',
+                        return_value=processor), mock.patch('signal.signal'):
+            call_command('run_extraction_worker', '--once', '--worker-id', 'test',
+                         '--max-attempts', '1', stdout=self.stdout, stderr=self.stderr)
+
+    def test_unsaveable_row_fails_alone(self):
+        self._run_worker([10.0, 123456789012.0, 30.0])
+        good, bad, other = self.invoices
+
+        statuses = dict(ExtractionJob.objects.values_list('invoice_id', 'status'))
+        self.assertEqual(statuses[good.pk], ExtractionJob.STATUS_DONE)
+        self.assertEqual(statuses[other.pk], ExtractionJob.STATUS_DONE)
+        self.assertEqual(statuses[bad.pk], ExtractionJob.STATUS_FAILED)
+        self.assertEqual(Invoice.objects.get(pk=good.pk).amount, Decimal('10.00'))
+        self.assertEqual(Invoice.objects.get(pk=other.pk).amount, Decimal('30.00'))
+        self.assertIsNone(Invoice.objects.get(pk=bad.pk).amount)
+
+        self.assertIn("test: completed 2/3 jobs", self.stdout.getvalue())
+        self.assertIn(f"test: job {ExtractionJob.objects.get(invoice=bad).pk} failed (giving up)",
+                      self.stderr.getvalue())
+
+        worker = ExtractionWorker.objects.get(pk='test')
+        self.assertEqual((worker.jobs_done, worker.jobs_failed), (2, 1))
+        self.assertIsNotNone(worker.stopped_at)
+
+    def test_unsaved_results_are_never_marked_done(self):
+        with mock.patch.object(ResultWriteBatcher, '_write', side_effect=OperationalError("locked")):
+            self._run_worker([10.0, 20.0, 30.0])
+
+        self.assertFalse(ExtractionJob.objects.filter(status=ExtractionJob.STATUS_DONE).exists())
+        self.assertFalse(Invoice.objects.filter(amount__isnull=False).exists())
+        self.assertEqual(self.stderr.getvalue().count("Saving results failed: locked"), 3)
+
+
+def read_sse(response):
+    """(event, data) pairs from a streamed text/event-stream response."""
+    body = b''.join(response.streaming_content).decode()
+    events = []
+    for frame in body.split('\n\n'):
+        fields = dict(line.split(': ', 1) for line in frame.splitlines() if not line.startswith(':'))
+        if 'event' in fields:
+            events.append((fields['event'], json.loads(fields['data'])))
+    return events
+
+
+class ExtractStreamTests(TransactionTestCase):
+    """SSE stage events from extract_stream (the extraction runs in a worker thread)."""
+
+    def setUp(self):
+        use_temp_media_root(self)
+        self.invoice = Invoice.objects.create(
+            original_file=ContentFile(b'%PDF-1.4 stream', name='bill.pdf'))
+        self.client = APIClient()
+
+    def _stream(self, controller=None):
+        def process_invoice(pdf_file, progress=None):
+            progress('pages_parsed', {'pages': 1, 'chars': 42})
+            progress('amount_found', {'amount': 108.82})
+            progress('dates_found', {'invoice_date': date(2024, 1, 5), 'due_date': None})
+            progress('ner_done', {'invoice_number': 'INV-7', 'bert_validated': False})
+            return ExtractionResult(
+                invoice_number=FieldCandidate('INV-7', 'regex_fallback', start=0, end=5),
+                invoice_date=FieldCandidate(date(2024, 1, 5), 'regex'),
+                amount=FieldCandidate(108.82, 'regex'),
+                extraction_method='bert_extraction',
+                confidence_score=0.8,
+            )
+
+        processor = mock.Mock(process_invoice=mock.Mock(side_effect=process_invoice))
+        controller = controller or AdmissionController()
+        with mock.patch('invoices.views.get_processor', return_value=processor), \
+                mock.patch('invoices.views.get_admission_controller', return_value=controller):
+            response = self.client.get(f'/api/invoices/{self.invoice.pk}/extract_stream/',
+                                       HTTP_ACCEPT='text/event-stream')
+            self.assertEqual(response['Content-Type'], 'text/event-stream')
+            return read_sse(response)
+
+    def test_stage_events_in_order_then_saved(self):
+        events = self._stream()
+
+        self.assertEqual([stage for stage, _ in events], [
+            'queued', 'started', 'pages_parsed', 'amount_found', 'dates_found', 'ner_done', 'saved',
+        ])
+        stages = dict(events)
+        self.assertEqual(stages['amount_found'], {'amount': 108.82})
+        self.assertEqual(stages['saved']['extracted_data']['invoice_number'], 'INV-7')
+        self.assertEqual(stages['saved']['provenance']['invoice_number']['method'], 'regex_fallback')
+
+        invoice = Invoice.objects.get(pk=self.invoice.pk)
+        self.assertEqual(invoice.amount, Decimal('108.82'))
+        self.assertEqual(invoice.invoice_date, date(2024, 1, 5))
+
+    def test_rejected_admission_is_an_error_event(self):
+        events = self._stream(controller=AdmissionController(max_per_user=0, retry_after=9))
+
+        self.assertEqual([stage for stage, _ in events], ['queued', 'error'])
+        self.assertEqual(events[1][1]['status'], 429)
+        self.assertEqual(events[1][1]['retry_after'], 9)
+        self.assertIsNone(Invoice.objects.get(pk=self.invoice.pk).amount)
+
+
+class ExtractTextNDJSONTests(TestCase):
+    """The line-streamed extract_text contract: one result or error line per record."""
+
+    URL = '/api/invoices/extract_text/'
+
+    def setUp(self):
+        with mock.patch.dict('sys.modules', {'transformers': None}):  # Regex path only
+            real = InvoiceProcessor()
+        self.batches = []
+
+        def process_texts(texts, batch_size=16):
+            self.batches.append(len(texts))
+            if any('BOOM' in text for text in texts):
+                raise RuntimeError("tokenizer exploded")
+            return real.process_texts(texts, batch_size)
+
+        self.processor = mock.Mock(process_texts=mock.Mock(side_effect=process_texts))
+        self.controller = AdmissionController(max_concurrent=4, max_per_user=4)
+        for target, value in (('invoices.views.get_processor', self.processor),
+                              ('invoices.views.get_admission_controller', self.controller)):
+            patcher = mock.patch(target, return_value=value)
+            patcher.start()
+            self.addCleanup(patcher.stop)
+
+    def _post(self, lines, query=''):
+        response = APIClient().post(self.URL + query, '\n'.join(lines),
+                                    content_type='application/x-ndjson')
+        self.assertEqual(response['Content-Type'], 'application/x-ndjson')
+        body = b''.join(response.streaming_content).decode()
+        return [json.loads(line) for line in body.splitlines()]
+
+    def test_results_carry_line_numbers_and_ids(self):
+        results = self._post([
+            json.dumps({'id': 'a', 'text': 'Invoice Number: INV-1 Total $10.00'}),
+            '',
+            json.dumps('Invoice Number: INV-2 Total $20.00'),
+        ])
+
+        self.assertEqual([(r['line'], r['id']) for r in results], [(1, 'a'), (3, None)])
+        self.assertEqual(results[0]['extracted_data']['invoice_number'], 'INV-1')
+        self.assertEqual(results[1]['extracted_data']['amount'], 20.0)
+        self.assertEqual(self.batches, [2])  # Blank line skipped, both texts in one batch
+
+    def test_bad_records_get_error_lines(self):
+        results = self._post([
+            '{not json',
+            json.dumps({'id': 7, 'body': 'no text key'}),
+            json.dumps(42),
+            json.dumps({'id': 8, 'text': '   '}),
+            json.dumps({'id': 9, 'text': 'Total $5.00'}),
+        ])
+
+        self.assertEqual([r['line'] for r in results], [1, 2, 3, 4, 5])
+        self.assertTrue(results[0]['error'].startswith("Invalid JSON"))
+        self.assertEqual(results[1]['error'], "Expected a string or an object with 'text'")
+        self.assertEqual(results[2]['error'], "Expected a string or an object with 'text'")
+        self.assertEqual((results[3]['id'], results[3]['error']), (8, "No text provided"))
+        self.assertEqual(results[4]['extracted_data']['amount'], 5.0)
+
+    def test_batch_size_is_capped(self):
+        records = [json.dumps(f'Total ${i}.00') for i in range(1, 131)]
+        self.assertEqual(len(self._post(records, '?batch_size=1000')), 130)
+        self.assertEqual(self.batches, [128, 2])
+
+        self.batches.clear()
+        self._post(records[:5], '?batch_size=2')
+        self.assertEqual(self.batches, [2, 2, 1])
+
+        self.batches.clear()
+        self._post(records[:20], '?batch_size=nope')
+        self.assertEqual(self.batches, [16, 4])
+
+    def test_failed_batch_falls_back_per_record(self):
+        results = self._post([
+            json.dumps({'id': 1, 'text': 'Total $1.00'}),
+            json.dumps({'id': 2, 'text': 'BOOM'}),
+            json.dumps({'id': 3, 'text': 'Total $3.00'}),
+        ])
+
+        self.assertEqual(self.batches, [3, 1, 1, 1])
+        self.assertEqual(results[0]['extracted_data']['amount'], 1.0)
+        self.assertEqual(results[1], {'line': 2, 'id': 2, 'status': 500,
+                                      'error': "Extraction failed: tokenizer exploded"})
+        self.assertEqual(results[2]['extracted_data']['amount'], 3.0)
+        self.assertEqual(self.controller.snapshot()['in_flight'], 0)
+
+    def test_rejected_batch_becomes_error_lines(self):
+        self.controller.max_per_user = 0
+        results = self._post([json.dumps({'id': i, 'text': 'Total $1.00'}) for i in (1, 2)])
+
+        self.assertEqual(self.batches, [])
+        self.assertEqual([(r['id'], r['status']) for r in results], [(1, 429), (2, 429)])
+        self.assertTrue(all('retry_after' in r for r in results))
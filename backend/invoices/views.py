@@ -1,12 +1,28 @@
+import json
+import queue
+import threading
+
 from rest_framework import viewsets, status
 from rest_framework.decorators import action
+from rest_framework.renderers import JSONRenderer
 from rest_framework.response import Response
+from django.db import IntegrityError, connection
 from django.contrib.auth.models import User
 from .models import Invoice
 from .serializers import InvoiceSerializer
-from .extraction import InvoiceProcessor
+from .extraction import get_processor
+from .admission import AdmissionRejected, get_admission_controller
+from .jobs import enqueue_extraction, queue_stats
+from .renderers import EventStreamRenderer, NDJSONRenderer, ndjson_line, sse_event
 from django.shortcuts import render
-from django.http import HttpResponse
+from django.http import HttpResponse, StreamingHttpResponse
+
+# Seconds between SSE keep-alive comments while a stage is still running
+SSE_KEEPALIVE_SECONDS = 10
+
+# Texts per NER batch for the text extraction endpoint (?batch_size= is capped here)
+TEXT_BATCH_SIZE = 16
+MAX_TEXT_BATCH_SIZE = 128
 
 class InvoiceViewSet(viewsets.ModelViewSet):
     serializer_class = InvoiceSerializer
@@ -26,35 +42,27 @@ class InvoiceViewSet(viewsets.ModelViewSet):
 
             print(f"Starting BERT extraction for invoice {invoice.id}...")
 
-            # Use simplified processor
-            processor = InvoiceProcessor()
-            file_path = invoice.original_file.path
-            result = processor.process_invoice(file_path)
+            # Admission control: bounded concurrency + per-user fair share
+            with get_admission_controller().slot(self._admission_key(request, invoice)):
+                # Shared processor keeps the BERT model loaded between requests
+                processor = get_processor()
+                # Open through the storage so compressed blobs work too
+                with invoice.original_file.open('rb') as pdf_file:
+                    result = processor.process_invoice(pdf_file)
 
             print(f"BERT extraction completed: {result}")
 
-            # Update invoice
-            invoice.invoice_date = result.get('invoice_date')
-            invoice.invoice_number = result.get('invoice_number')
-            invoice.amount = result.get('amount')
-            invoice.due_date = result.get('due_date')
-            invoice.extraction_method = result.get('extraction_method', 'bert_extraction')
-            invoice.confidence_score = result.get('confidence_score', 0.0)
-            invoice.raw_text = result.get('raw_text', '')
-
-            invoice.save()
-
-            return Response({
-                "message": "BERT extraction completed!",
-                "extraction_method": invoice.extraction_method,
-                "confidence_score": invoice.confidence_score,
-                "extracted_data": {
-                    "invoice_date": invoice.invoice_date,
-                    "invoice_number": invoice.invoice_number,
-                    "amount": invoice.amount,
-                    "due_date": invoice.due_date,
-                }
-            })
+            self._apply_extraction(invoice, result)
+
+            return Response(self._extraction_payload(invoice, result))
+
+        except AdmissionRejected as e:
+            print(f"Extraction rejected for invoice {invoice.id}: {e}")
+            return Response(
+                {"error": str(e), "retry_after": e.retry_after},
+                status=e.status_code,
+                headers={"Retry-After": str(e.retry_after)}
+            )
 
         except Exception as e:
             print(f"Extraction failed: {str(e)}")
@@ -63,6 +71,277 @@ class InvoiceViewSet(viewsets.ModelViewSet):
                 status=status.HTTP_500_INTERNAL_SERVER_ERROR
             )
 
+    @action(detail=True, methods=['post'])
+    def enqueue_extraction(self, request, pk=None):
+        """Queue extraction for the worker pool (manage.py run_extraction_worker)"""
+        invoice = self.get_object()
+        if not invoice.original_file:
+            return Response(
+                {"error": "No PDF file attached"},
+                status=status.HTTP_400_BAD_REQUEST
+            )
+
+        try:
+            job = enqueue_extraction(invoice)
+        except IntegrityError:
+            # Deleted between get_object() and the insert
+            return Response(
+                {"error": "Invoice no longer exists"},
+                status=status.HTTP_404_NOT_FOUND
+            )
+        return Response(
+            {"job_id": job.id, "invoice_id": invoice.id, "status": job.status},
+            status=status.HTTP_202_ACCEPTED
+        )
+
+    @action(detail=True, methods=['get', 'post'],
+            renderer_classes=[EventStreamRenderer, JSONRenderer])
+    def extract_stream(self, request, pk=None):
+        """Extract information using BERT, streaming stage events over SSE"""
+        invoice = self.get_object()
+
+        if not invoice.original_file:
+            return Response(
+                {"error": "No PDF file attached"},
+                status=status.HTTP_400_BAD_REQUEST
+            )
+
+        # Extraction runs in a worker thread so the stream can keep the
+        # connection alive while a long stage (e.g. NER) is still going
+        events = queue.Queue()
+        worker = threading.Thread(
+            target=self._run_streamed_extraction,
+            args=(invoice, self._admission_key(request, invoice), events),
+            daemon=True,
+        )
+        worker.start()
+
+        response = StreamingHttpResponse(
+            self._event_stream(events),
+            content_type='text/event-stream'
+        )
+        response['Cache-Control'] = 'no-cache'
+        response['X-Accel-Buffering'] = 'no'  # Stop nginx from buffering events
+        return response
+
+    def _run_streamed_extraction(self, invoice, user_key, events):
+        """Worker thread body: run extraction and push (stage, data) events"""
+        def emit(stage, data):
+            events.put((stage, data))
+
+        try:
+            controller = get_admission_controller()
+            emit('queued', {'invoice_id': invoice.id, **controller.snapshot()})
+
+            with controller.slot(user_key):
+                emit('started', {'invoice_id': invoice.id})
+                processor = get_processor()
+                with invoice.original_file.open('rb') as pdf_file:
+                    result = processor.process_invoice(pdf_file, progress=emit)
+
+                self._apply_extraction(invoice, result)
+                emit('saved', self._extraction_payload(invoice, result))
+
+        except AdmissionRejected as e:
+            print(f"Extraction rejected for invoice {invoice.id}: {e}")
+            emit('error', {
+                "error": str(e),
+                "status": e.status_code,
+                "retry_after": e.retry_after,
+            })
+
+        except Exception as e:
+            print(f"Extraction failed: {str(e)}")
+            emit('error', {"error": f"Extraction failed: {str(e)}", "status": 500})
+
+        finally:
+            events.put(None)
+            connection.close()  # This thread's DB connection
+
+    def _event_stream(self, events):
+        """Turn queued stage events into SSE frames until the worker is done"""
+        while True:
+            try:
+                item = events.get(timeout=SSE_KEEPALIVE_SECONDS)
+            except queue.Empty:
+                yield ": keep-alive\n\n"
+                continue
+
+            if item is None:
+                return
+
+            stage, data = item
+            yield sse_event(stage, data)
+
+    def _apply_extraction(self, invoice, result):
+        """Copy an extraction result onto the invoice and save only those columns"""
+        invoice.save(update_fields=result.apply_to(invoice))
+
+    def _extraction_payload(self, invoice, result):
+        """API response body describing a finished extraction"""
+        return {
+            "message": "BERT extraction completed!",
+            "extraction_method": invoice.extraction_method,
+            "confidence_score": invoice.confidence_score,
+            "extracted_data": {
+                "invoice_date": invoice.invoice_date,
+                "invoice_number": invoice.invoice_number,
+                "amount": invoice.amount,
+                "due_date": invoice.due_date,
+            },
+            "provenance": result.provenance(),
+        }
+
+    @action(detail=False, methods=['post'],
+            renderer_classes=[JSONRenderer, NDJSONRenderer])
+    def extract_text(self, request):
+        """
+        Extract from invoice text directly, skipping PDF parsing.
+
+        - application/json  {"text": "..."}   -> one JSON result
+        - text/plain        raw invoice text  -> one JSON result
+        - application/x-ndjson  one {"id": ..., "text": "..."} (or a bare
+          JSON string) per line -> one JSON result per line, streamed back
+          as each NER batch finishes
+        """
+        content_type = request.content_type.split(';')[0].strip()
+        user_key = self._admission_key(request)
+
+        if content_type == 'application/x-ndjson':
+            batch_size = self._text_batch_size(request)
+            response = StreamingHttpResponse(
+                self._stream_text_results(request.stream, batch_size, user_key),
+                content_type='application/x-ndjson'
+            )
+            response['X-Accel-Buffering'] = 'no'
+            return response
+
+        if content_type == 'text/plain':
+            text = request.body.decode(request.encoding or 'utf-8', errors='replace')
+        else:
+            text = request.data.get('text') if hasattr(request.data, 'get') else None
+
+        if not text or not isinstance(text, str):
+            return Response(
+                {"error": "No text provided"},
+                status=status.HTTP_400_BAD_REQUEST
+            )
+
+        try:
+            with get_admission_controller().slot(user_key):
+                result = get_processor().process_text(text)
+
+            return Response(self._text_result_payload(result))
+
+        except AdmissionRejected as e:
+            return Response(
+                {"error": str(e), "retry_after": e.retry_after},
+                status=e.status_code,
+                headers={"Retry-After": str(e.retry_after)}
+            )
+
+    def _stream_text_results(self, stream, batch_size, user_key):
+        """Read NDJSON records lazily, extract them in batches, yield result lines"""
+        batch = []
+        for line_number, line in enumerate(stream or [], start=1):
+            line = line.strip()
+            if not line:
+                continue
+
+            try:
+                record = json.loads(line)
+            except ValueError as e:
+                yield ndjson_line({"line": line_number, "error": f"Invalid JSON: {e}"})
+                continue
+
+            if isinstance(record, str):
+                record = {"text": record}
+            if not isinstance(record, dict) or not isinstance(record.get('text'), str):
+                yield ndjson_line({"line": line_number, "error": "Expected a string or an object with 'text'"})
+                continue
+
+            batch.append((line_number, record.get('id'), record['text']))
+            if len(batch) >= batch_size:
+                yield from self._extract_text_batch(batch, user_key)
+                batch = []
+
+        if batch:
+            yield from self._extract_text_batch(batch, user_key)
+
+    def _extract_text_batch(self, batch, user_key):
+        """Run one NER batch under admission control and yield its result lines"""
+        try:
+            with get_admission_controller().slot(user_key):
+                try:
+                    results = get_processor().process_texts([text for _, _, text in batch], len(batch))
+                except Exception as e:
+                    # Don't cut the stream short: retry record by record so one
+                    # bad text only costs its own line
+                    print(f"Text batch extraction failed, retrying per record: {e}")
+                    results = [self._extract_single_text(text) for _, _, text in batch]
+        except AdmissionRejected as e:
+            for line_number, record_id, _ in batch:
+                yield ndjson_line({
+                    "line": line_number,
+                    "id": record_id,
+                    "error": str(e),
+                    "status": e.status_code,
+                    "retry_after": e.retry_after,
+                })
+            return
+
+        for (line_number, record_id, _), result in zip(batch, results):
+            if isinstance(result, Exception):
+                yield ndjson_line({"line": line_number, "id": record_id,
+                                   "error": f"Extraction failed: {result}", "status": 500})
+                continue
+            yield ndjson_line({"line": line_number, "id": record_id,
+                               **self._text_result_payload(result)})
+
+    def _extract_single_text(self, text):
+        """Result for one text, or the exception it raised"""
+        try:
+            return get_processor().process_texts([text], 1)[0]
+        except Exception as e:
+            return e
+
+    def _text_batch_size(self, request):
+        try:
+            size = int(request.query_params.get('batch_size', TEXT_BATCH_SIZE))
+        except ValueError:
+            size = TEXT_BATCH_SIZE
+        return max(1, min(size, MAX_TEXT_BATCH_SIZE))
+
+    def _text_result_payload(self, result):
+        """API body for a text extraction (no invoice row involved)"""
+        payload = {
+            "extraction_method": result.extraction_method,
+            "confidence_score": result.confidence_score,
+            "extracted_data": {
+                "invoice_date": result.value('invoice_date'),
+                "invoice_number": result.value('invoice_number'),
+                "amount": result.value('amount'),
+                "due_date": result.value('due_date'),
+            },
+            "provenance": result.provenance(),
+        }
+        if result.error:
+            payload["error"] = result.error
+        return payload
+
+    @action(detail=False, methods=['get'])
+    def extraction_metrics(self, request):
+        """In-flight extractions for this process, plus the shared job queue and workers"""
+        return Response({**get_admission_controller().snapshot(), "queue": queue_stats()})
+
+    def _admission_key(self, request, invoice=None):
+        """Fair-share key: invoice owner, then request user, then client IP"""
+        if invoice is not None and invoice.user_id:
+            return f"user:{invoice.user_id}"
+        if request.user and request.user.is_authenticated:
+            return f"user:{request.user.pk}"
+        return f"ip:{request.META.get('REMOTE_ADDR', 'unknown')}"
+
 def invoice_table(request):
     """Simple table view"""
     invoices = Invoice.objects.all()
@@ -63,18 +63,10 @@ class InvoiceExtractor {
             this.invoices.unshift(invoice);
             this.showUploadProgress(60, 'Extracting information...');
 
-            // Extract information
-            const extractResponse = await fetch(
-                `${this.apiBase}/invoices/${invoice.id}/extract_information/`,
-                { method: 'POST' }
-            );
-
-            if (!extractResponse.ok) {
-                throw new Error('Failed to extract information');
-            }
+            // Extract information (streams stage events as they happen)
+            const extractionResult = await this.streamExtraction(invoice);
 
             this.showUploadProgress(90, 'Processing results...');
-            const extractionResult = await extractResponse.json();
 
             // Update invoice with extracted data
             const updatedInvoice = {
@@ -101,6 +93,53 @@ class InvoiceExtractor {
         }
     }
 
+    streamExtraction(invoice) {
+        // Each stage moves the progress bar and fills in fields found so far
+        const fields = ['amount', 'invoice_date', 'due_date', 'invoice_number'];
+        const stages = {
+            queued: [62, 'Waiting for a free extraction slot...'],
+            started: [65, 'Parsing PDF pages...'],
+            pages_parsed: [70, 'Looking for the amount...'],
+            amount_found: [75, 'Looking for dates...'],
+            dates_found: [80, 'Running entity recognition...'],
+            ner_done: [85, 'Saving results...'],
+        };
+
+        return new Promise((resolve, reject) => {
+            const source = new EventSource(
+                `${this.apiBase}/invoices/${invoice.id}/extract_stream/`
+            );
+
+            Object.entries(stages).forEach(([stage, [percent, text]]) => {
+                source.addEventListener(stage, (e) => {
+                    const data = JSON.parse(e.data);
+                    const found = fields.filter((f) => f in data);
+                    found.forEach((f) => { invoice[f] = data[f]; });
+                    this.showUploadProgress(percent, text);
+
+                    // Show partial fields right away instead of waiting for 'saved'
+                    if (found.length) {
+                        this.currentInvoice = invoice;
+                        this.updateInvoiceList();
+                        this.displayResults(invoice);
+                    }
+                });
+            });
+
+            source.addEventListener('saved', (e) => {
+                source.close();
+                resolve(JSON.parse(e.data));
+            });
+
+            source.addEventListener('error', (e) => {
+                // Close before the browser tries to reconnect and re-run extraction
+                source.close();
+                const detail = e.data ? JSON.parse(e.data).error : null;
+                reject(new Error(detail || 'Failed to extract information'));
+            });
+        });
+    }
+
     showUploadProgress(percent, text) {
         const progressSection = document.getElementById('uploadProgress');
         const progressBar = document.getElementById('progressBar');